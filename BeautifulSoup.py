@@ -153,6 +153,7 @@ class PageElement(object):
     def extract(self):
         """Destructively rips this element out of the tree."""
         if self.parent:
+            self.parent._clearNameIndexes()
             try:
                 del self.parent.contents[self.parent.index(self)]
             except ValueError:
@@ -179,6 +180,14 @@ class PageElement(object):
         self.previousSibling = self.nextSibling = None
         return self
 
+    def _clearNameIndexes(self):
+        """Forgets the name indexes of this tag and every tag above it,
+        whose descendants are about to change."""
+        tag = self
+        while tag is not None:
+            tag._nameIndex = None
+            tag = tag.parent
+
     def _lastRecursiveChild(self):
         "Finds the last element beneath this object to be parsed."
         lastChild = self
@@ -205,6 +214,7 @@ class PageElement(object):
                     position = position - 1
             newChild.extract()
 
+        self._clearNameIndexes()
         newChild.parent = self
         previousChild = None
         if position == 0:
@@ -495,6 +505,23 @@ class Tag(PageElement):
 
     XML_SPECIAL_CHARS_TO_ENTITIES = _invert(XML_ENTITIES_TO_SPECIAL_CHARS)
 
+    # The references _convertEntities converts in attribute values.
+    ATTRIBUTE_ENTITY = re.compile("&(#\d+|#x[0-9a-fA-F]+|\w+);")
+
+    # Whether find() and findAll() by a plain tag name use an index of
+    # this tag's descendants by name. findAll() builds the index, as it
+    # walks every descendant anyway; find() walks until the first match,
+    # and builds the index on its next search if that walk was longer
+    # than NAME_INDEX_MIN_WALK elements.
+    #
+    # The index isn't told when a tag is renamed, so it's off unless a
+    # parser class turns it on for the tags it builds, for trees whose
+    # tags keep their names.
+    useNameIndex = False
+    NAME_INDEX_MIN_WALK = 32
+    _nameIndex = None
+    _indexNextSearch = False
+
     def _convertEntities(self, match):
         """Used in a call to re.sub to replace HTML, XML, and numeric
         entities with the appropriate Unicode characters. If HTML
@@ -528,6 +555,8 @@ class Tag(PageElement):
         # chunks be garbage-collected
         self.parserClass = parser.__class__
         self.isSelfClosing = parser.isSelfClosingTag(name)
+        if parser.useNameIndex:
+            self.useNameIndex = True
         self.name = name
         if attrs is None:
             attrs = []
@@ -541,11 +570,13 @@ class Tag(PageElement):
         self.escapeUnrecognizedEntities = parser.escapeUnrecognizedEntities
 
         # Convert any HTML, XML, or numeric entities in the attribute values.
-        convert = lambda(k, val): (k,
-                                   re.sub("&(#\d+|#x[0-9a-fA-F]+|\w+);",
-                                          self._convertEntities,
-                                          val))
-        self.attrs = map(convert, self.attrs)
+        for k, val in attrs:
+            if '&' in val:
+                convert = lambda(k, val): (k,
+                                           self.ATTRIBUTE_ENTITY.sub(
+                                               self._convertEntities, val))
+                self.attrs = map(convert, attrs)
+                break
 
     def getString(self):
         if (len(self.contents) == 1
@@ -783,6 +814,7 @@ class Tag(PageElement):
             next = current.next
             if isinstance(current, Tag):
                 del current.contents[:]
+                current._nameIndex = None
             current.parent = None
             current.previous = None
             current.previousSibling = None
@@ -820,6 +852,11 @@ class Tag(PageElement):
              **kwargs):
         """Return only the first child of this Tag matching the given
         criteria."""
+        found = self._findByName(name, attrs, recursive, text, kwargs, True)
+        if found is not None:
+            if found:
+                return found[0]
+            return None
         r = None
         l = self.findAll(name, attrs, recursive, text, 1, **kwargs)
         if l:
@@ -838,6 +875,13 @@ class Tag(PageElement):
         callable that takes a string and returns whether or not the
         string matches for some custom definition of 'matches'. The
         same is true of the tag name."""
+        found = self._findByName(name, attrs, recursive, text, kwargs)
+        if found is not None:
+            if limit:
+                results = ResultSet(SoupStrainer(name))
+                results.extend(found[:limit])
+                return results
+            return list(found)
         generator = self.recursiveChildGenerator
         if not recursive:
             generator = self.childGenerator
@@ -856,6 +900,49 @@ class Tag(PageElement):
 
     #Private methods
 
+    def _findByName(self, name, attrs, recursive, text, kwargs,
+                    firstOnly=False):
+        """Returns the descendants named name, in document order, from
+        the name index, or None if the search isn't by a plain name."""
+        if not (self.useNameIndex and recursive and text is None
+                and not attrs and not kwargs
+                and isinstance(name, basestring) and name):
+            return None
+        if self._nameIndex is None:
+            if firstOnly and not self._indexNextSearch:
+                return self._walkForName(name)
+            self._buildNameIndex()
+        return self._nameIndex.get(name, [])
+
+    def _walkForName(self, name):
+        """Returns a list of the first descendant named name, or an empty
+        list, without an index."""
+        walked = 0
+        found = []
+        for element in self.recursiveChildGenerator():
+            walked += 1
+            if isinstance(element, Tag) and element.name == name:
+                found.append(element)
+                break
+        if walked > self.NAME_INDEX_MIN_WALK:
+            self._indexNextSearch = True
+        return found
+
+    def _buildNameIndex(self):
+        index = {}
+        for element in self.recursiveChildGenerator():
+            if isinstance(element, Tag):
+                index.setdefault(element.name, []).append(element)
+        self._nameIndex = index
+
+        # The parser adds tags without insert(), so it needs to know to
+        # forget the indexes of the tags it's adding to.
+        root = self
+        while root.parent is not None:
+            root = root.parent
+        if isinstance(root, BeautifulStoneSoup):
+            root._nameIndexed = True
+
     def _getAttrMap(self):
         """Initializes a map representation of this tag's attributes,
         if not already initialized."""
@@ -1031,6 +1118,188 @@ def buildTagMap(default, *args):
 
 # Now, the parser classes.
 
+class EntityDecoder:
+    """Decodes every entity and character reference in a run of text,
+    each ended by a semicolon, into what BeautifulStoneSoup's
+    handle_entityref and handle_charref would have made of it, with
+    one regular expression and a table of the known entities built
+    once for each way a soup can be told to convert entities.
+
+    A soup that doesn't convert entities leaves every reference as it
+    is, so its decoder returns the text untouched."""
+
+    REFERENCE = re.compile('&(#[0-9]+|[a-zA-Z][-.a-zA-Z0-9]*);')
+
+    def __init__(self, convertCharrefs, convertHTMLEntities,
+                 convertXMLEntities):
+        self.convertCharrefs = convertCharrefs
+        self.convertHTMLEntities = convertHTMLEntities
+        self.isIdentity = not (convertCharrefs or convertHTMLEntities or
+                               convertXMLEntities)
+        specialChars = Tag.XML_ENTITIES_TO_SPECIAL_CHARS
+        self.entities = {}
+        if convertHTMLEntities:
+            for name, codepoint in name2codepoint.items():
+                self.entities[name] = unichr(codepoint)
+        for name, char in specialChars.items():
+            if name in self.entities:
+                continue
+            if convertXMLEntities:
+                self.entities[name] = char
+            else:
+                self.entities[name] = '&%s;' % name
+        if convertHTMLEntities:
+            # Assumed to be a misplaced ampersand; see handle_entityref.
+            self.unknownEntity = '&amp;%s'
+        else:
+            self.unknownEntity = '&%s;'
+
+    def _decodeReference(self, match):
+        ref = match.group(1)
+        if ref[0] == '#':
+            if self.convertCharrefs:
+                return unichr(int(ref[1:]))
+            return match.group(0)
+        data = self.entities.get(ref)
+        if data is None:
+            return self.unknownEntity % ref
+        return data
+
+    def decode(self, text):
+        if self.isIdentity:
+            return text
+        return self.REFERENCE.sub(self._decodeReference, text)
+
+# The entity decoder for each (convertEntities, convertHTMLEntities,
+# convertXMLEntities) a soup can have.
+_entityDecoders = {}
+
+def entityDecoder(convertCharrefs, convertHTMLEntities, convertXMLEntities):
+    key = (bool(convertCharrefs), bool(convertHTMLEntities),
+           bool(convertXMLEntities))
+    decoder = _entityDecoders.get(key)
+    if decoder is None:
+        decoder = _entityDecoders[key] = EntityDecoder(*key)
+    return decoder
+
+class XMLTokenizer:
+    """Splits well-formed XML into the same calls to a parser's handlers
+    that SGMLParser.goahead() makes, with one compiled regular
+    expression instead of SGMLParser's scanning loop.
+
+    Only the common forms of text, start and end tags, character and
+    entity references, comments and processing instructions are
+    recognized. Anything else, such as a declaration, an unquoted
+    attribute value or a token cut off at the end of the data, stops
+    the tokenizer, and the rest of parser.rawdata is left for
+    SGMLParser to parse as it always has.
+
+    A run of text and the references in it that end in semicolons is
+    one token, handed to the parser's handle_text to be decoded in one
+    step. Other references, and ampersands that don't start one, are
+    handled one at a time, as SGMLParser handles them."""
+
+    TOKEN = re.compile(r"""
+        ((?:[^&<]+|&\#[0-9]+;|&[a-zA-Z][-.a-zA-Z0-9]*;)+)  # 1: text
+      | <([a-zA-Z][-_.a-zA-Z0-9]*)                  # 2: start tag name
+         ((?:\s+[a-zA-Z_][-:.a-zA-Z_0-9]*\s*=\s*
+             (?:"[^"<>]*"|'[^'<>]*'))*)             # 3: attributes
+         \s*(/?)\s*>                                # 4: self-closing slash
+      | </([a-zA-Z][-_.:a-zA-Z0-9]*)\s*>            # 5: end tag name
+      | &\#([0-9]+)(?=[^0-9])                       # 6: character reference
+      | &([a-zA-Z][-.a-zA-Z0-9]*)(?=[^a-zA-Z0-9])   # 7: entity reference
+      | (&\#(?=[^0-9])|&(?=[^\#a-zA-Z]))            # 8: a stray ampersand
+      | <!--(.*?)--\s*>                             # 9: comment
+      | <\?([^>]*)>                                 # 10: processing instruction
+      """, re.VERBOSE | re.DOTALL)
+
+    ATTRIBUTE = re.compile(r"""\s+([a-zA-Z_][-:.a-zA-Z_0-9]*)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+
+    def __init__(self):
+        # Whether each (parser class, tag name) has no start_, do_ or
+        # end_ method, so its tags can go straight to unknown_starttag
+        # and unknown_endtag.
+        self.plainStartTags = {}
+        self.plainEndTags = {}
+
+    def tokenize(self, parser):
+        """Feeds the tokens at the start of parser.rawdata to the parser
+        and removes them from it."""
+        rawdata = parser.rawdata
+        match = self.TOKEN.match
+        parserClass = parser.__class__
+        plainStartTags = self.plainStartTags
+        plainEndTags = self.plainEndTags
+        handle_data = parser.handle_data
+        handle_text = parser.handle_text
+        unknown_starttag = parser.unknown_starttag
+        unknown_endtag = parser.unknown_endtag
+        i = 0
+        n = len(rawdata)
+        while i < n and not parser.literal and not parser.nomoretags:
+            token = match(rawdata, i)
+            if token is None:
+                break
+            kind = token.lastindex
+            if kind == 1:
+                text = token.group(1)
+                if '&' in text:
+                    handle_text(text)
+                else:
+                    handle_data(text)
+            elif kind == 4:
+                if rawdata[token.end(2)] == '/':
+                    # SGML shorthand: <tag/data/ == <tag>data</tag>
+                    break
+                name = token.group(2).lower()
+                attrs = []
+                if token.group(3):
+                    for (attrName, double, single) in \
+                            self.ATTRIBUTE.findall(token.group(3)):
+                        value = double or single
+                        if '&' in value:
+                            value = parser.entity_or_charref.sub(
+                                parser._convert_ref, value)
+                        attrs.append((attrName.lower(), value))
+                parser.lasttag = name
+                key = (parserClass, name)
+                plain = plainStartTags.get(key)
+                if plain is None:
+                    plain = not (hasattr(parserClass, 'start_' + name) or
+                                 hasattr(parserClass, 'do_' + name))
+                    plainStartTags[key] = plain
+                if plain:
+                    unknown_starttag(name, attrs)
+                else:
+                    parser.finish_starttag(name, attrs)
+            elif kind == 5:
+                name = token.group(5).lower()
+                key = (parserClass, name)
+                plain = plainEndTags.get(key)
+                if plain is None:
+                    plain = not hasattr(parserClass, 'end_' + name)
+                    plainEndTags[key] = plain
+                if plain and name not in parser.stack:
+                    unknown_endtag(name)
+                else:
+                    parser.finish_endtag(name)
+                parser.literal = 0
+            elif kind == 6:
+                parser.handle_charref(token.group(6))
+            elif kind == 7:
+                parser.handle_entityref(token.group(7))
+            elif kind == 8:
+                handle_data(token.group(8))
+            elif kind == 9:
+                parser.handle_comment(token.group(9))
+            else:
+                parser.handle_pi(token.group(10))
+            i = token.end()
+        parser.rawdata = rawdata[i:]
+
+# A tokenizer to pass to BeautifulStoneSoup for well-formed XML.
+XML_TOKENIZER = XMLTokenizer()
+
 class BeautifulStoneSoup(Tag, SGMLParser):
 
     """This class contains the basic parser and search code. It defines
@@ -1063,6 +1332,20 @@ class BeautifulStoneSoup(Tag, SGMLParser):
 
     ROOT_TAG_NAME = u'[document]'
 
+    # Whether a tag in this document has been given a name index.
+    _nameIndexed = False
+
+    # Splits the markup into tokens ahead of SGMLParser; see XMLTokenizer.
+    tokenizer = None
+
+    # Whether the markup is taken to be well-formed XML; see __init__.
+    strict = False
+
+    # An empty element is the same as a start tag and its end tag.
+    STRICT_MARKUP_MASSAGE = [(re.compile('<([a-zA-Z][-_.a-zA-Z0-9]*)([^<>]*?)\s*/>'),
+                              lambda x: '<%s%s></%s>' % (x.group(1), x.group(2),
+                                                         x.group(1)))]
+
     HTML_ENTITIES = "html"
     XML_ENTITIES = "xml"
     XHTML_ENTITIES = "xhtml"
@@ -1077,7 +1360,8 @@ class BeautifulStoneSoup(Tag, SGMLParser):
 
     def __init__(self, markup="", parseOnlyThese=None, fromEncoding=None,
                  markupMassage=True, smartQuotesTo=XML_ENTITIES,
-                 convertEntities=None, selfClosingTags=None, isHTML=False):
+                 convertEntities=None, selfClosingTags=None, isHTML=False,
+                 tokenizer=None, strict=False):
         """The Soup object is initialized as the 'root tag', and the
         provided markup (which can be a string or a file-like object)
         is fed into the underlying parser.
@@ -1101,8 +1385,26 @@ class BeautifulStoneSoup(Tag, SGMLParser):
 
         You can pass in a custom list of (RE object, replace method)
         tuples to get Beautiful Soup to scrub your input the way you
-        want."""
-
+        want.
+
+        For well-formed XML, pass XML_TOKENIZER (or another object with
+        a tokenize(parser) method) as tokenizer to parse it faster. It
+        builds the same tree, and leaves whatever it doesn't recognize
+        to sgmllib.
+
+        If the markup is well-formed XML, you can also pass in True for
+        strict. Every tag is then closed by the next end tag, and no
+        tag closes another: the nesting rules, SELF_CLOSING_TAGS and
+        QUOTE_TAGS are ignored, and <tag/> is an empty tag. An end tag
+        that doesn't match the innermost open tag, a tag left open or
+        a document cut off in the middle of a tag raises
+        UnbalancedTagError instead of being fixed up. A strict soup
+        can't be given parseOnlyThese."""
+
+        if strict:
+            if parseOnlyThese:
+                raise ValueError("A strict soup can't be given parseOnlyThese.")
+            self.strict = strict
         self.parseOnlyThese = parseOnlyThese
         self.fromEncoding = fromEncoding
         self.smartQuotesTo = smartQuotesTo
@@ -1131,7 +1433,12 @@ class BeautifulStoneSoup(Tag, SGMLParser):
             self.convertHTMLEntities = False
             self.escapeUnrecognizedEntities = False
 
+        self.entityDecoder = entityDecoder(self.convertEntities,
+                                           self.convertHTMLEntities,
+                                           self.convertXMLEntities)
         self.instanceSelfClosingTags = buildTagMap(None, selfClosingTags)
+        if tokenizer is not None:
+            self.tokenizer = tokenizer
         SGMLParser.__init__(self)
 
         if hasattr(markup, 'read'):        # It's a file-type object.
@@ -1170,7 +1477,7 @@ class BeautifulStoneSoup(Tag, SGMLParser):
         if markup:
             if self.markupMassage:
                 if not hasattr(self.markupMassage, "__iter__"):
-                    self.markupMassage = self.MARKUP_MASSAGE
+                    self.markupMassage = self.defaultMarkupMassage()
                 for fix, m in self.markupMassage:
                     markup = fix.sub(m, markup)
                 # TODO: We get rid of markupMassage so that the
@@ -1182,11 +1489,34 @@ class BeautifulStoneSoup(Tag, SGMLParser):
         self.reset()
 
         SGMLParser.feed(self, markup)
-        # Close out any unfinished strings and close all the open tags.
+        self.closeOpenTags()
+
+    def defaultMarkupMassage(self):
+        """The massage used unless the soup is given its own."""
+        if self.strict:
+            return self.STRICT_MARKUP_MASSAGE
+        return self.MARKUP_MASSAGE
+
+    def closeOpenTags(self):
+        """Closes out any unfinished strings and all the open tags, once
+        the whole document has been fed to the parser."""
         self.endData()
+        if self.strict:
+            if self.rawdata:
+                raise UnbalancedTagError("The document ends in the middle "
+                                         "of %r" % self.rawdata[:40])
+            if self.currentTag is not self:
+                self._unbalancedTag(None)
         while self.currentTag.name != self.ROOT_TAG_NAME:
             self.popTag()
 
+    def goahead(self, end):
+        """Lets the tokenizer, if there is one, parse as much of the
+        data as it can before SGMLParser parses the rest."""
+        if self.tokenizer is not None:
+            self.tokenizer.tokenize(self)
+        SGMLParser.goahead(self, end)
+
     def __getattr__(self, methodName):
         """This method routes method call requests to either the SGMLParser
         superclass or the Tag superclass, depending on the method name."""
@@ -1208,6 +1538,9 @@ class BeautifulStoneSoup(Tag, SGMLParser):
 
     def reset(self):
         Tag.__init__(self, self, self.ROOT_TAG_NAME)
+        self._nameIndex = None
+        self._indexNextSearch = False
+        self._nameIndexed = False
         self.hidden = 1
         SGMLParser.reset(self)
         self.currentData = []
@@ -1226,6 +1559,11 @@ class BeautifulStoneSoup(Tag, SGMLParser):
 
     def pushTag(self, tag):
         #print "Push", tag.name
+        if self._nameIndexed:
+            # Only the open tags are gaining a descendant.
+            for openTag in self.tagStack:
+                openTag._nameIndex = None
+            self._nameIndexed = False
         if self.currentTag:
             self.currentTag.contents.append(tag)
         self.tagStack.append(tag)
@@ -1235,8 +1573,9 @@ class BeautifulStoneSoup(Tag, SGMLParser):
         if self.currentData:
             currentData = u''.join(self.currentData)
             if (currentData.translate(self.STRIP_ASCII_SPACES) == '' and
-                not set([tag.name for tag in self.tagStack]).intersection(
-                    self.PRESERVE_WHITESPACE_TAGS)):
+                (not self.PRESERVE_WHITESPACE_TAGS or
+                 not set([tag.name for tag in self.tagStack]).intersection(
+                    self.PRESERVE_WHITESPACE_TAGS))):
                 if '\n' in currentData:
                     currentData = '\n'
                 else:
@@ -1322,8 +1661,35 @@ class BeautifulStoneSoup(Tag, SGMLParser):
         if popTo:
             self._popToTag(popTo, inclusive)
 
+    def _unbalancedTag(self, name):
+        """Raises UnbalancedTagError for an end tag that doesn't close
+        the innermost open tag, or for the end of the document (None)
+        while tags are still open."""
+        openTags = [tag.name for tag in self.tagStack[1:]]
+        if name is None:
+            message = "<%s> is never closed" % self.currentTag.name
+        elif not openTags:
+            message = "</%s> has no open tag to close" % name
+        else:
+            message = "</%s> doesn't close <%s>" % (name,
+                                                   self.currentTag.name)
+        if openTags:
+            message += " (open tags: %s)" % ' > '.join(openTags)
+        raise UnbalancedTagError(message)
+
     def unknown_starttag(self, name, attrs, selfClosing=0):
         #print "Start tag %s: %s" % (name, attrs)
+        if self.strict:
+            # The tags are balanced, so no tag closes another.
+            self.endData()
+            tag = Tag(self, name, attrs, self.currentTag, self.previous)
+            if self.previous:
+                self.previous.next = tag
+            self.previous = tag
+            self.pushTag(tag)
+            if selfClosing:
+                self.popTag()
+            return tag
         if self.quoteStack:
             #This is not a real tag.
             #print "<%s> is not real!" % name
@@ -1354,6 +1720,12 @@ class BeautifulStoneSoup(Tag, SGMLParser):
 
     def unknown_endtag(self, name):
         #print "End tag %s" % name
+        if self.strict:
+            self.endData()
+            if name != self.currentTag.name or self.currentTag is self:
+                self._unbalancedTag(name)
+            self.popTag()
+            return
         if self.quoteStack and self.quoteStack[-1] != name:
             #This is not a real end tag.
             #print "</%s> is not real!" % name
@@ -1368,6 +1740,12 @@ class BeautifulStoneSoup(Tag, SGMLParser):
     def handle_data(self, data):
         self.currentData.append(data)
 
+    def handle_text(self, text):
+        """Handle data whose entity and character references, each
+        ended by a semicolon, are still in it, as if each reference
+        had been passed to handle_entityref or handle_charref."""
+        self.handle_data(self.entityDecoder.decode(text))
+
     def _toStringSubclass(self, text, subclass):
         """Adds a certain piece of text to the tree as a NavigableString
         subclass."""
@@ -1618,6 +1996,11 @@ class BeautifulSoup(BeautifulStoneSoup):
 class StopParsing(Exception):
     pass
 
+class UnbalancedTagError(SGMLParseError):
+    """Raised by a strict BeautifulStoneSoup when the markup's tags
+    aren't balanced."""
+    pass
+
 class ICantBelieveItsBeautifulSoup(BeautifulSoup):
 
     """The BeautifulSoup class is oriented towards skipping over
@@ -1761,13 +2144,32 @@ class UnicodeDammit:
     CHARSET_ALIASES = { "macintosh" : "mac-roman",
                         "x-sjis" : "shift-jis" }
 
+    # Declared encodings that don't say which byte order is used. The
+    # sniffed encoding is used instead.
+    BYTE_ORDER_ENCODINGS = ('iso-10646-ucs-2', 'ucs-2', 'csunicode',
+                            'iso-10646-ucs-4', 'ucs-4', 'csucs4',
+                            'utf-16', 'utf-32', 'utf_16', 'utf_32',
+                            'utf16', 'u16')
+
+    # The encoding named by the XML declaration a document starts with.
+    XML_DECLARATION = re.compile('<\?xml[^>]*?\sencoding=[\'"]([^\'"<>]*)[\'"]')
+
     def __init__(self, markup, overrideEncodings=[],
                  smartQuotesTo='xml', isHTML=False):
         self.declaredHTMLEncoding = None
-        self.markup, documentEncoding, sniffedEncoding = \
-                     self._detectEncoding(markup, isHTML)
         self.smartQuotesTo = smartQuotesTo
         self.triedEncodings = []
+        if (not isHTML and isinstance(markup, str) and markup
+            and not self._hasSignature(markup)):
+            # Nothing needs sniffing, so the encodings we've been given
+            # and the declared encoding are tried straight away.
+            self.markup = markup
+            u = self._convertFromGiven(overrideEncodings)
+            if u:
+                self.unicode = u
+                return
+        self.markup, documentEncoding, sniffedEncoding = \
+                     self._detectEncoding(markup, isHTML)
         if markup == '' or isinstance(markup, unicode):
             self.originalEncoding = None
             self.unicode = unicode(markup)
@@ -1795,6 +2197,28 @@ class UnicodeDammit:
         self.unicode = u
         if not u: self.originalEncoding = None
 
+    def _hasSignature(self, data):
+        """Whether data starts with a byte order mark, or with bytes
+        that _detectEncoding takes to be UTF-16, UTF-32 or EBCDIC."""
+        return ('\x00' in data[:4] or data[:2] in ('\xfe\xff', '\xff\xfe')
+                or data[:3] == '\xef\xbb\xbf' or data[:4] == '\x4c\x6f\xa7\x94')
+
+    def _convertFromGiven(self, overrideEncodings):
+        """Tries each of overrideEncodings, then the encoding in the
+        markup's XML declaration, in the order the full detection
+        would. Returns the Unicode markup, or None if none of them
+        decodes it."""
+        for proposedEncoding in overrideEncodings:
+            u = self._convertFrom(proposedEncoding)
+            if u:
+                return u
+        match = self.XML_DECLARATION.match(self.markup)
+        if match is not None:
+            declaredEncoding = match.group(1).lower()
+            if declaredEncoding not in self.BYTE_ORDER_ENCODINGS:
+                return self._convertFrom(declaredEncoding)
+        return None
+
     def _subMSChar(self, orig):
         """Changes a MS smart quote character to an XML or HTML
         entity."""
@@ -1919,10 +2343,7 @@ class UnicodeDammit:
             if isHTML:
                 self.declaredHTMLEncoding = xml_encoding
             if sniffed_xml_encoding and \
-               (xml_encoding in ('iso-10646-ucs-2', 'ucs-2', 'csunicode',
-                                 'iso-10646-ucs-4', 'ucs-4', 'csucs4',
-                                 'utf-16', 'utf-32', 'utf_16', 'utf_32',
-                                 'utf16', 'u16')):
+               (xml_encoding in self.BYTE_ORDER_ENCODINGS):
                 xml_encoding = sniffed_xml_encoding
         return xml_data, xml_encoding, sniffed_xml_encoding
 
@@ -0,0 +1,414 @@
+#
+#  cache.py
+#  The cache of pages downloaded from Lighthouse.
+#
+#  Pages are stored in two levels of directories named after the start of the hash
+#  of their URL, so that no directory grows too large. An SQLite index records the
+#  size of every entry and when it was stored and last used, so checking an entry
+#  or evicting entries never lists a directory. When the cache grows past its size
+#  or entry limit, the least recently used entries are removed, and entries that
+#  haven't been used for max_age_days are removed whenever the cache is opened.
+#
+#  Entries are written to a temporary file and renamed into place, so a reader
+#  never sees half of a page. Several threads or keeper processes can share one
+#  cache: each entry has an advisory lock file, which get_xml holds while it
+#  downloads the page so that a second request for it waits and reads the result.
+#
+#  Copyright 2010 Jeff Verkoeyen. Licensed under the Apache License, Version 2.0.
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import thread
+import threading
+import time
+
+try:
+	import fcntl
+except ImportError:
+	# No advisory locks; concurrent requests for a page may both download it.
+	fcntl = None
+
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_MAX_AGE_DAYS = 30
+
+INDEX_NAME = 'index.sqlite'
+
+# A temporary file that hasn't been written to for this long was left by a
+# process that was killed; a younger one may still be renamed into place.
+TEMP_MAX_AGE_SECONDS = 60 * 60
+
+# Cache entries that start with these bytes were stored with gzip.
+GZIP_MAGIC = '\x1f\x8b'
+
+class Cache(object):
+	"""The pages cached in the directory at path, fresh for expiration_seconds after they're stored.
+
+	The index is opened the first time it's needed, and every method can be
+	called from any thread."""
+
+	def __init__(self, path, expiration_seconds, max_bytes=DEFAULT_MAX_BYTES,
+			max_entries=DEFAULT_MAX_ENTRIES, max_age_days=DEFAULT_MAX_AGE_DAYS):
+		self.path = path
+		self.expiration_seconds = expiration_seconds
+		self.max_bytes = max_bytes
+		self.max_entries = max_entries
+		self.max_age_days = max_age_days
+		self.db = None
+		self.entries = 0
+		self.bytes = 0
+		self.lock = threading.RLock()
+
+	def open(self):
+		self.lock.acquire()
+		try:
+			if self.db is not None:
+				return
+			if not os.path.isdir(self.path):
+				os.makedirs(self.path)
+			# Other keeper processes may be writing to the index, so wait for them.
+			self.db = sqlite3.connect(os.path.join(self.path, INDEX_NAME), timeout=60,
+				check_same_thread=False)
+			# A lost write only loses a cache entry; the files it leaves behind are pruned.
+			self.db.execute('PRAGMA synchronous = OFF')
+			self.db.execute("""CREATE TABLE IF NOT EXISTS entries (
+				key TEXT PRIMARY KEY,
+				size INTEGER NOT NULL,
+				stored_at REAL NOT NULL,
+				used_at REAL NOT NULL
+			)""")
+			self.db.execute('CREATE INDEX IF NOT EXISTS entries_used_at ON entries (used_at)')
+			self.count_entries()
+			self.expire()
+			self.db.commit()
+		finally:
+			self.lock.release()
+
+	def count_entries(self):
+		"""Read the number of entries and their total size, which other processes may have changed."""
+
+		(self.entries, self.bytes) = self.db.execute(
+			'SELECT COUNT(*), IFNULL(SUM(size), 0) FROM entries').fetchone()
+
+	def key(self, url):
+		return hashlib.sha224(url).hexdigest()
+
+	def entry_path(self, key):
+		return os.path.join(self.path, key[0:2], key[2:4], key)
+
+	def lookup(self, key):
+		"""The (size, stored_at, used_at) of the entry, or None if it isn't cached."""
+
+		self.open()
+		self.lock.acquire()
+		try:
+			return self.db.execute('SELECT size, stored_at, used_at FROM entries WHERE key = ?',
+				(key,)).fetchone()
+		finally:
+			self.lock.release()
+
+	def is_fresh(self, url):
+		"""Whether url is cached and was stored less than expiration_seconds ago."""
+
+		row = self.lookup(self.key(url))
+		return row is not None and (time.time() - row[1]) < self.expiration_seconds
+
+	def get(self, url):
+		"""The cached data for url, or None."""
+
+		key = self.key(url)
+		if self.lookup(key) is None:
+			return None
+
+		try:
+			f = open(self.entry_path(key), 'rb')
+		except IOError:
+			self.remove(key)
+			return None
+		is_compressed = f.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+		f.seek(0)
+		if is_compressed:
+			data = gzip.GzipFile(fileobj=f, mode='rb').read()
+		else:
+			data = f.read()
+		f.close()
+
+		self.mark_used(key)
+		return data
+
+	def get_metadata(self, url):
+		"""The metadata stored with a cached url, such as its response validators. {} if there is none."""
+
+		key = self.key(url)
+		if self.lookup(key) is None:
+			return {}
+
+		try:
+			f = open(self.entry_path(key) + '.meta', 'r')
+		except IOError:
+			return {}
+		try:
+			return json.load(f)
+		except ValueError:
+			return {}
+		finally:
+			f.close()
+
+	def make_directory(self, key):
+		directory = os.path.dirname(self.entry_path(key))
+		if not os.path.isdir(directory):
+			try:
+				os.makedirs(directory)
+			except OSError:
+				# Made by another thread or process in the meantime.
+				pass
+
+	def temp_path(self, path):
+		"""A file next to path that no other thread or process writes to."""
+
+		return '%s.%d-%d.tmp' % (path, os.getpid(), thread.get_ident())
+
+	def put(self, url, data, metadata=None, compress=False):
+		"""Store the data for url, compressed with gzip if compress is True."""
+
+		key = self.key(url)
+		path = self.entry_path(key)
+		self.make_directory(key)
+
+		temp_path = self.temp_path(path)
+		f = open(temp_path, 'wb')
+		if compress:
+			compressed = gzip.GzipFile(fileobj=f, mode='wb')
+			compressed.write(data)
+			compressed.close()
+		else:
+			f.write(data)
+		f.close()
+		size = os.path.getsize(temp_path)
+		os.rename(temp_path, path)
+
+		if metadata is not None:
+			f = open(temp_path, 'w')
+			json.dump(metadata, f)
+			f.close()
+			size += os.path.getsize(temp_path)
+			os.rename(temp_path, path + '.meta')
+
+		now = time.time()
+		self.open()
+		self.lock.acquire()
+		try:
+			self.db.execute('INSERT OR REPLACE INTO entries (key, size, stored_at, used_at) VALUES (?, ?, ?, ?)',
+				(key, size, now, now))
+			self.count_entries()
+			self.evict(keep=key)
+			self.db.commit()
+		finally:
+			self.lock.release()
+
+	def touch(self, url):
+		"""Mark a cached url as fresh again."""
+
+		now = time.time()
+		self.open()
+		self.lock.acquire()
+		try:
+			self.db.execute('UPDATE entries SET stored_at = ?, used_at = ? WHERE key = ?',
+				(now, now, self.key(url)))
+			self.db.commit()
+		finally:
+			self.lock.release()
+
+	def mark_used(self, key):
+		self.lock.acquire()
+		try:
+			self.db.execute('UPDATE entries SET used_at = ? WHERE key = ?', (time.time(), key))
+			self.db.commit()
+		finally:
+			self.lock.release()
+
+	def remove(self, key):
+		"""Forget the entry and delete its files. Its lock file is left for prune, as
+		another thread or process may be holding it."""
+
+		self.open()
+		self.lock.acquire()
+		try:
+			row = self.db.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+			if row is None:
+				return 0
+			self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+			self.entries -= 1
+			self.bytes -= row[0]
+		finally:
+			self.lock.release()
+
+		path = self.entry_path(key)
+		for name in [path, path + '.meta']:
+			try:
+				os.remove(name)
+			except OSError:
+				pass
+		return row[0]
+
+	def lock_entry(self, url):
+		"""Wait for and take url's advisory lock. Pass the result to unlock_entry."""
+
+		key = self.key(url)
+		path = self.entry_path(key) + '.lock'
+		while True:
+			self.make_directory(key)
+			lock = open(path, 'a')
+			if fcntl is None:
+				return lock
+			fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+			# prune may have deleted the lock file while this waited for it, in which
+			# case the lock is on a file that no one else will open.
+			try:
+				if os.fstat(lock.fileno()).st_ino == os.stat(path).st_ino:
+					return lock
+			except OSError:
+				pass
+			lock.close()
+
+	def remove_lock_file(self, path):
+		"""Delete the lock file at path unless it's locked. Returns whether it was deleted."""
+
+		if fcntl is None:
+			# There's no telling whether it's in use.
+			return False
+		try:
+			lock = open(path, 'r')
+		except IOError:
+			return False
+		try:
+			try:
+				fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except IOError:
+				return False
+			os.remove(path)
+			return True
+		finally:
+			lock.close()
+
+	def unlock_entry(self, lock):
+		if fcntl is not None:
+			fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+		lock.close()
+
+	def evict(self, keep=None):
+		"""Remove the least recently used entries until the cache is within its limits.
+		Returns (entries removed, bytes freed)."""
+
+		removed = 0
+		freed = 0
+		self.open()
+		self.lock.acquire()
+		try:
+			while self.entries > self.max_entries or self.bytes > self.max_bytes:
+				keys = [row[0] for row in self.db.execute(
+					'SELECT key FROM entries WHERE key != ? ORDER BY used_at LIMIT 100', (keep or '',))]
+				if len(keys) == 0:
+					break
+				for key in keys:
+					if self.entries <= self.max_entries and self.bytes <= self.max_bytes:
+						break
+					freed += self.remove(key)
+					removed += 1
+			self.db.commit()
+		finally:
+			self.lock.release()
+		return (removed, freed)
+
+	def expire(self):
+		"""Remove the entries that haven't been used for max_age_days. Returns (entries removed, bytes freed)."""
+
+		removed = 0
+		freed = 0
+		self.lock.acquire()
+		try:
+			oldest = time.time() - self.max_age_days * 24 * 60 * 60
+			keys = [row[0] for row in self.db.execute('SELECT key FROM entries WHERE used_at < ?', (oldest,))]
+			for key in keys:
+				freed += self.remove(key)
+				removed += 1
+			self.db.commit()
+		finally:
+			self.lock.release()
+		return (removed, freed)
+
+	def prune(self):
+		"""Expire and evict entries, then delete any file in the cache that isn't in the index,
+		such as pages cached before there was an index or temporary files left by a
+		process that was killed. Temporary files younger than TEMP_MAX_AGE_SECONDS are
+		left alone, as another process may still be writing them. Returns (entries
+		removed, bytes freed)."""
+
+		self.open()
+		(removed, freed) = self.expire()
+		(evicted, evicted_bytes) = self.evict()
+		removed += evicted
+		freed += evicted_bytes
+
+		self.lock.acquire()
+		try:
+			keys = set([row[0] for row in self.db.execute('SELECT key FROM entries')])
+		finally:
+			self.lock.release()
+
+		for (directory, directories, files) in os.walk(self.path):
+			for name in files:
+				key = name.split('.')[0]
+				if name.startswith(INDEX_NAME) or (key in keys and name in [key, key + '.meta', key + '.lock']):
+					continue
+				path = os.path.join(directory, name)
+				if name.endswith('.lock'):
+					self.remove_lock_file(path)
+					continue
+				try:
+					if name.endswith('.tmp') and time.time() - os.path.getmtime(path) < TEMP_MAX_AGE_SECONDS:
+						continue
+					freed += os.path.getsize(path)
+					os.remove(path)
+				except OSError:
+					# Removed or renamed into place by another process in the meantime.
+					continue
+				if name == key:
+					removed += 1
+		return (removed, freed)
+
+	def stats(self):
+		"""A dictionary of the number of entries, their total size, the limits, and the
+		times the least and most recently used entries were used (None if empty)."""
+
+		self.open()
+		self.lock.acquire()
+		try:
+			self.count_entries()
+			(least_recent, most_recent) = self.db.execute('SELECT MIN(used_at), MAX(used_at) FROM entries').fetchone()
+		finally:
+			self.lock.release()
+		return {
+			'entries': self.entries,
+			'bytes': self.bytes,
+			'max_entries': self.max_entries,
+			'max_bytes': self.max_bytes,
+			'max_age_days': self.max_age_days,
+			'least_recently_used': least_recent,
+			'most_recently_used': most_recent,
+		}
+
+	def close(self):
+		self.lock.acquire()
+		try:
+			if self.db is not None:
+				self.db.commit()
+				self.db.close()
+				self.db = None
+		finally:
+			self.lock.release()
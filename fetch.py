@@ -0,0 +1,155 @@
+#
+#  fetch.py
+#  Fetches Lighthouse pages on a bounded pool of threads.
+#
+#  Ticket pages are crawled ahead of time: as soon as page N comes back with
+#  tickets, page N+1 is requested, up to a few pages ahead of the reader, and the
+#  next project's crawl starts while a project is being read.
+#  Pages are handed back in whatever order they're asked for, so the sync still
+#  processes projects and pages in a deterministic order.
+#
+#  Copyright 2010 Jeff Verkoeyen. Licensed under the Apache License, Version 2.0.
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+
+import Queue
+import network
+import sys
+import threading
+
+DEFAULT_CONCURRENCY = 4
+
+# How many pages of a crawl may be fetched ahead of the page being read.
+DEFAULT_PAGES_AHEAD = 10
+
+# How many crawls may be started ahead of the one being read. Each holds up to
+# DEFAULT_PAGES_AHEAD pages, and its fetches queue up with the current crawl's.
+DEFAULT_CRAWLS_AHEAD = 1
+
+class Fetch(object):
+	"""A page that has been requested from the scheduler."""
+
+	def __init__(self, endpoint, callback=None):
+		self.endpoint = endpoint
+		self.callback = callback
+		self.xml = None
+		self.encoding = None
+		self.exc_info = None
+		self.is_done = threading.Event()
+
+	def get(self):
+		"""Wait for the page and return (its XML, its encoding), raising whatever the fetch raised."""
+
+		self.is_done.wait()
+		if self.exc_info is not None:
+			raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+		return (self.xml, self.encoding)
+
+class Crawl(object):
+	"""The pages of a paginated endpoint, fetched in order ahead of the reader.
+
+	url_for_page(page) is the endpoint of a page and is_last_page(xml) tells whether
+	a page is past the end. A page is only requested once the page before it is
+	known to have more to come, so no more pages are fetched than a sequential
+	crawl would fetch."""
+
+	def __init__(self, scheduler, url_for_page, is_last_page, pages_ahead=DEFAULT_PAGES_AHEAD):
+		self.scheduler = scheduler
+		self.url_for_page = url_for_page
+		self.is_last_page = is_last_page
+		self.pages_ahead = max(1, pages_ahead)
+		self.fetches = {}
+		self.next_page = 1
+		self.reading_page = 1
+		self.last_full_page = 0
+		self.lock = threading.Lock()
+		self.schedule()
+
+	def schedule(self):
+		self.lock.acquire()
+		try:
+			while (self.next_page <= self.last_full_page + 1
+					and self.next_page <= self.reading_page + self.pages_ahead):
+				page = self.next_page
+				self.next_page += 1
+				self.fetches[page] = self.scheduler.submit(self.url_for_page(page),
+					lambda fetch, page=page: self.fetched(page, fetch))
+		finally:
+			self.lock.release()
+
+	def fetched(self, page, fetch):
+		if fetch.exc_info is None and not self.is_last_page(fetch.xml):
+			self.lock.acquire()
+			self.last_full_page = max(self.last_full_page, page)
+			self.lock.release()
+			self.schedule()
+
+	def get(self, page):
+		"""The (XML, encoding) of the page, waiting for it to be fetched if needed."""
+
+		self.lock.acquire()
+		try:
+			self.reading_page = page
+			fetch = self.fetches.pop(page, None)
+		finally:
+			self.lock.release()
+		self.schedule()
+
+		if fetch is None:
+			fetch = self.scheduler.submit(self.url_for_page(page))
+		return fetch.get()
+
+class Scheduler(object):
+	"""Runs network.get_xml on at most concurrency threads at a time."""
+
+	def __init__(self, config, concurrency=DEFAULT_CONCURRENCY):
+		self.config = config
+		self.queue = Queue.Queue()
+		self.threads = []
+
+		for i in range(max(1, concurrency)):
+			thread = threading.Thread(target=self.work)
+			thread.daemon = True
+			thread.start()
+			self.threads.append(thread)
+
+	def work(self):
+		while True:
+			fetch = self.queue.get()
+			if fetch is None:
+				return
+			try:
+				(fetch.xml, fetch.encoding) = network.get_xml(fetch.endpoint, self.config)
+			except Exception:
+				fetch.exc_info = sys.exc_info()
+			# The callback runs first so that a crawl has requested the next page
+			# by the time the reader sees this one.
+			if fetch.callback is not None:
+				fetch.callback(fetch)
+			fetch.is_done.set()
+
+	def submit(self, endpoint, callback=None):
+		"""Start fetching the endpoint. callback(fetch) is called on the fetching thread."""
+
+		fetch = Fetch(endpoint, callback)
+		self.queue.put(fetch)
+		return fetch
+
+	def crawl(self, url_for_page, is_last_page, pages_ahead=DEFAULT_PAGES_AHEAD):
+		"""Start crawling the pages of an endpoint. Returns the Crawl to read them from."""
+
+		return Crawl(self, url_for_page, is_last_page, pages_ahead)
+
+	def close(self):
+		"""Drop the fetches that haven't started and stop the threads."""
+
+		try:
+			while True:
+				self.queue.get_nowait()
+		except Queue.Empty:
+			pass
+		for thread in self.threads:
+			self.queue.put(None)
+		for thread in self.threads:
+			thread.join()
+		self.threads = []
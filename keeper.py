@@ -24,14 +24,22 @@
 #
 
 from optparse import OptionParser
-import BeautifulSoup
 import ConfigParser
+import cache
+import collections
+import datetime
+import fetch
 import hashlib
+import metrics
 import network
-import os
+import reconcile
+import records
+import shlex
+import state
 import subprocess
 import sys
 import things
+import urllib
 
 class Config(dict):
 	"""The configuration information for this script."""
@@ -39,6 +47,12 @@ class Config(dict):
 	def __init__(self, options):
 		self.required_options = ['token', 'account']
 		self.is_verbose = options.is_verbose
+		self.batch_size = options.batch_size
+		self.is_dry_run = options.is_dry_run
+		self.is_full_sync = options.is_full_sync
+		self.concurrency = options.concurrency
+		self.lighthouse_url = options.base_url
+		self.compress_cache = options.compress_cache
 
 		any_missing = False
 		for name in self.required_options:
@@ -62,6 +76,8 @@ class Config(dict):
 			exit
 			
 	def base_url(self):
+		if self.lighthouse_url is not None:
+			return self.lighthouse_url
 		return 'http://%s.lighthouseapp.com/' % (self['account'])
 	
 	def log(self, text=""):
@@ -72,53 +88,101 @@ class Lighthouse(object):
 	# TODO: Make these configurable.
 	cache_path = 'cache'
 	cache_expiration_seconds = 60*60
+	state_path = 'state.sqlite'
 
-	def __init__(self, config):
+	def __init__(self, config, sync_state):
 		self.config = config
+		self.sync_state = sync_state
 		self.projects = []
 
-		try:
-			os.mkdir(Lighthouse.cache_path)
-		except Exception:
-			pass
-
 	def update_projects(self):
 		self.config.log("Fetching the projects list...")
 
-		xml = network.get_xml(Project.endpoint, self.config)
-		data = network.xml_to_data(xml)
+		(xml, encoding) = network.get_xml(Project.endpoint, self.config)
 		
 		self.projects = []
-		
-		for project_data in data.projects:
-			if not isinstance(project_data, BeautifulSoup.Tag):
-				continue
 
-			project = Project(project_data, self.config)
-			project.update_tickets()
+		# One query for every Things project instead of a name search per project. The ids
+		# are remembered in things.lookups.
+		things.get_project_ids()
+		
+		for project_data in network.xml_to_records(xml, 'project', Project.fields, encoding):
+			started = metrics.start()
+			project = Project(project_data, self.config, self.sync_state)
+			metrics.stop('records.project', started)
 			self.projects.append(project)
 
-
-class Project(dict):
+		scheduler = fetch.Scheduler(self.config, self.config.concurrency)
+		writer = things.Writer()
+		try:
+			# The next projects' pages download while a project syncs, and Things runs each
+			# batch while the next one is planned. Only a few crawls are open at a time, so
+			# their pages don't pile up in memory or hold up the project being synced.
+			crawls = {}
+			for (index, project) in enumerate(self.projects):
+				for ahead in range(index, min(index + fetch.DEFAULT_CRAWLS_AHEAD + 1, len(self.projects))):
+					if ahead not in crawls:
+						crawls[ahead] = self.projects[ahead].crawl_tickets(scheduler)
+				project.update_tickets(crawls.pop(index), writer)
+		finally:
+			writer.close()
+			scheduler.close()
+
+		self.config.log("Things lookups: %d answered from memory, %d sent to Things" % (
+			things.lookups.hits, things.lookups.misses))
+		metrics.count('things.lookups.hit', things.lookups.hits)
+		metrics.count('things.lookups.miss', things.lookups.misses)
+
+
+class Project(records.Record):
+	__slots__ = ['config', 'sync_state', 'high_water', 'is_new', 'lighthouse_id', 'things_id', 'things_name']
 	endpoint = "projects.xml"
+	# The elements of a project that are read. The rest are never parsed into a tree.
+	fields = ['description', 'id', 'name']
 	
-	def __init__(self, project_data, config):
+	def __init__(self, project_data, config, sync_state):
+		records.Record.__init__(self, project_data)
 		self.config = config
-		self.tickets = []
-		
-		for node in project_data.contents:
-			if not isinstance(node, BeautifulSoup.Tag):
-				continue
-			self[node.name] = node.string
+		self.sync_state = sync_state
+		self.high_water = None
+		self.is_new = False
 
 		self.lighthouse_id = self['id']
-		self.things_id = things.get_project_id(self.name())
+		self.things_id = None
+		# The project's name in Things, which is the old name until a renamed project is synced.
+		self.things_name = self.name()
+
+		# The Things id stored for the project is tried first, in case it was renamed in Lighthouse.
+		stored_id = self.sync_state.get_project(self.lighthouse_id)
+		if stored_id is not None:
+			things_name = things.get_project_name(stored_id)
+			if things_name is not None:
+				self.things_id = stored_id
+				self.things_name = things_name
+		if self.things_id is None:
+			self.things_id = things.get_project_id(self.name())
 
 		if self.things_id is None:
-			self.config.log("Creating a new Things project for " + self['name'] + "...")
-			self.things_id = things.create_project(self.name(), self.description())
+			self.is_new = True
+			if self.config.is_dry_run:
+				print "Create project \"%s\"" % (self.name())
+			else:
+				self.config.log("Creating a new Things project for " + self['name'] + "...")
+				self.things_id = things.create_project(self.name(), self.description())
+				# Whatever was synced before went to a Things project that's gone.
+				self.sync_state.forget_project(self.lighthouse_id)
+		elif self.config.is_dry_run:
+			if self.things_name != self.name():
+				print "Rename project \"%s\" to \"%s\"" % (self.things_name, self.name())
 		else:
-			things.set_project_description(self.name(), self.description())
+			if self.things_name != self.name():
+				self.config.log("Renaming the Things project " + self.things_name + "...")
+				if things.rename_project_by_id(self.things_id, self.things_name, self.name()):
+					self.things_name = self.name()
+			things.set_project_description_by_id(self.things_id, self.description())
+
+		if self.things_id is not None and not self.config.is_dry_run:
+			self.sync_state.put_project(self.lighthouse_id, self.things_id)
 		
 		self.config.log("")
 
@@ -134,70 +198,267 @@ class Project(dict):
 		description += "Imported from Lighthouse"
 		return description
 
-	def tasks_list_url(self):
-		return 'projects/%s/tickets.xml' % (self.lighthouse_id)
+	def tasks_list_url(self, page, updated_since=None):
+		url = 'projects/%s/tickets.xml?page=%d' % (self.lighthouse_id, page)
+		if updated_since is not None:
+			url += '&q=' + urllib.quote('updated:"since %s"' % (updated_since))
+		return url
 
-	def update_tickets(self):
-		self.config.log("Updating the tickets...")
+	def updated_since(self):
+		"""The date to fetch updated tickets from, or None to fetch every ticket.
 
-		self.tickets = []
+		One day before the newest synced updated-at, so that no ticket is missed
+		because of time zones. Tickets that are fetched again are skipped anyway."""
 
-		page = 1
-		while True:
-			self.config.log("Page " + str(page))
-			xml = network.get_xml(self.tasks_list_url() + '?page=' + str(page), self.config)
-			data = network.xml_to_data(xml)
+		if self.config.is_full_sync or self.is_new:
+			return None
+		high_water = self.sync_state.get_high_water(self.lighthouse_id)
+		if high_water is None:
+			return None
+		try:
+			date = datetime.datetime.strptime(high_water[:10], '%Y-%m-%d')
+		except ValueError:
+			return None
+		return (date - datetime.timedelta(days=1)).strftime('%Y-%m-%d')
 
-			if data.tickets is None or len(data.tickets) == 0:
-				break
+	def update_high_water(self):
+		"""Remember the newest updated-at of this project's tickets for the next incremental fetch."""
 
-			page = page + 1
+		if self.high_water is not None:
+			self.sync_state.put_high_water(self.lighthouse_id, self.high_water)
+
+	def crawl_tickets(self, scheduler):
+		"""Start fetching the pages of this project's tickets."""
 
-			for ticket_data in data.tickets:
-				if not isinstance(ticket_data, BeautifulSoup.Tag):
-					continue
+		updated_since = self.updated_since()
+		if updated_since is not None:
+			self.config.log("Fetching the tickets of " + self['name'] + " updated since " + updated_since)
 
-				ticket = Ticket(ticket_data, self.name(), self.config)
-				self.tickets.append(ticket)
+		# An empty page of tickets has no <ticket> elements.
+		return scheduler.crawl(lambda page: self.tasks_list_url(page, updated_since),
+			lambda xml: xml.find('<ticket>') < 0)
+
+	def read_tickets(self, crawl):
+		"""This project's tickets, one at a time as each page is parsed.
+
+		high_water is moved up to the newest updated-at that has been read."""
+
+		page = 1
+		while True:
+			self.config.log("Page " + str(page))
+			# Time spent waiting for Lighthouse rather than working.
+			started = metrics.start()
+			(xml, encoding) = crawl.get(page)
+			metrics.stop('fetch.wait', started)
+
+			reader = network.RecordReader('ticket', Ticket.fields, encoding)
+			count = 0
+			for ticket_data in reader.read(xml):
+				started = metrics.start()
+				ticket = Ticket(ticket_data)
+				metrics.stop('records.ticket', started)
+				updated_at = ticket.get('updated-at')
+				if updated_at is not None and (self.high_water is None or updated_at > self.high_water):
+					self.high_water = updated_at
+				count += 1
+				yield ticket
+
+			if count == 0:
+				return
+
+			self.config.log("Skipped %d unused elements" % (reader.skipped))
+			page = page + 1
 			
 			self.config.log("")
 
-class Ticket(dict):
-	
-	def __init__(self, ticket_data, project_name, config):
-		self.project_name = project_name
-		self.config = config
-		
-		for node in ticket_data.contents:
-			if not isinstance(node, BeautifulSoup.Tag):
+	def update_tickets(self, crawl, writer=None):
+		"""Sync the tickets as their pages arrive.
+
+		A changed ticket is planned and queued in a batch as soon as it's read, and
+		full batches are run by the writer while the next pages are parsed, so only
+		the tickets of the batches waiting for Things are held at a time."""
+
+		self.config.log("Updating the tickets...")
+
+		# Tickets that haven't changed since they were last synced are left alone. A new
+		# Things project has none of them yet.
+		stored_tickets = {}
+		self.high_water = None
+		if not self.is_new:
+			stored_tickets = self.sync_state.get_tickets(self.lighthouse_id)
+			self.high_water = self.sync_state.get_high_water(self.lighthouse_id)
+
+		to_dos = None
+		to_dos_by_id = None
+		batch = things.Batch(self.config.batch_size, writer)
+		queued = collections.deque()
+		ticket_count = 0
+		changed_count = 0
+		change_count = 0
+		failed_count = 0
+
+		for ticket in self.read_tickets(crawl):
+			ticket_count += 1
+			stored = stored_tickets.get(ticket['number'])
+			if stored is not None and stored.matches(ticket):
+				continue
+			changed_count += 1
+
+			if to_dos is None:
+				# Every to do in the project is read up front, so looking up a ticket's to do
+				# doesn't need a round-trip to Things.
+				snapshot = None
+				if not self.is_new:
+					snapshot = things.get_project_snapshot(self.things_name)
+				if snapshot is None:
+					snapshot = {}
+				to_dos = reconcile.index_by_number(snapshot)
+				to_dos_by_id = reconcile.index_by_id(snapshot)
+
+			things_id = None
+			if stored is not None:
+				things_id = stored.things_id
+			to_do = reconcile.match(ticket, to_dos, to_dos_by_id, things_id)
+			changes = reconcile.plan_ticket(ticket, to_do)
+			change_count += len(changes)
+
+			if self.config.is_dry_run:
+				for change in changes:
+					print change.describe()
 				continue
-			self[node.name] = node.string
 
-		self.things_id = things.get_ticket_id(self.project_name, self.name())
-		if self.things_id is None:
-			self.config.log("Creating a new Things to do for " + self['title'] + "...")
-			self.things_id = things.create_ticket(self.project_name, self.name(), self['original-body'], self['url'])
-		
-		if self['state'] == 'resolved':
-			things.complete_ticket(self.project_name, self.name())
-		
-		things.set_ticket_tags(self.project_name, self.name(), self['tag'])
+			queued.append((ticket, reconcile.execute(changes, self.things_name, batch)))
+			failed_count += self.store_tickets(queued)
+
+		batch.flush()
+		if writer is not None:
+			writer.wait()
+		failed_count += self.store_tickets(queued)
+
+		self.config.log("%d of %d tickets changed since the last sync" % (changed_count, ticket_count))
+		self.config.log("%d changes for %d tickets" % (change_count, changed_count))
+
+		if self.config.is_dry_run:
+			return
+		if failed_count == 0:
+			self.update_high_water()
+		self.sync_state.commit()
+
+	def store_tickets(self, queued):
+		"""Store the tickets at the front of queued, a deque of (ticket, [(change, operation)]),
+		whose operations have all run. Returns the number of tickets that failed.
+
+		Failed tickets aren't stored, so they are tried again on the next sync."""
+
+		failed_count = 0
+		while len(queued) > 0:
+			(ticket, operations) = queued[0]
+			if not all([operation.is_done for (change, operation) in operations]):
+				break
+			queued.popleft()
+
+			is_failed = False
+			for (change, operation) in operations:
+				if operation.error is not None:
+					is_failed = True
+				elif change.kind == reconcile.CREATE and ticket.things_id is None:
+					ticket.things_id = operation.result
+
+			if is_failed:
+				failed_count += 1
+			elif ticket.things_id is not None:
+				self.sync_state.put_ticket(self.lighthouse_id, ticket)
+		return failed_count
+
+class Ticket(records.Record):
+	__slots__ = ['things_id']
+	# The elements of a ticket that are read: the synced fields and what identifies a change.
+	fields = state.synced_fields + ['number', 'updated-at']
+	# A ticket's tags are often its own, so only its state is shared.
+	shared_fields = ['state']
+	# Only read for tickets that changed since the last sync.
+	lazy_fields = ['original-body', 'url']
+	
+	def __init__(self, ticket_data):
+		records.Record.__init__(self, ticket_data)
+		self.things_id = None
 
 	def name(self):
 		return self['title'] + ' (Lighthouse number: ' + self['number'] + ')'
 
+def format_time(timestamp):
+	if timestamp is None:
+		return "never"
+	return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+def print_cache_stats(stats):
+	megabyte = 1024.0 * 1024.0
+	print "Cached pages:        %d (at most %d)" % (stats['entries'], stats['max_entries'])
+	print "Cache size:          %.1f MB (at most %.1f MB)" % (stats['bytes'] / megabyte, stats['max_bytes'] / megabyte)
+	print "Least recently used: " + format_time(stats['least_recently_used'])
+	print "Most recently used:  " + format_time(stats['most_recently_used'])
+	print "Pages unused for %d days are removed." % (stats['max_age_days'])
+
 if __name__ == "__main__":
 	parser = OptionParser()
 	
 	parser.add_option("-a", "--account", dest="account", help="Your Lighthouse account")
+	parser.add_option("--base-url", dest="base_url",
+						help="The Lighthouse URL to use instead of http://<account>.lighthouseapp.com/")
+	parser.add_option("-b", "--batch-size", dest="batch_size", type="int", default=things.DEFAULT_BATCH_SIZE,
+						help="The number of Things operations to send in each script (default: %d)" % things.DEFAULT_BATCH_SIZE)
+	parser.add_option("--cache-max-age", dest="cache_max_age", type="int", default=cache.DEFAULT_MAX_AGE_DAYS,
+						help="Days before an unused cached page is removed (default: %d)" % cache.DEFAULT_MAX_AGE_DAYS)
+	parser.add_option("--cache-max-entries", dest="cache_max_entries", type="int", default=cache.DEFAULT_MAX_ENTRIES,
+						help="The most pages to keep cached (default: %d)" % cache.DEFAULT_MAX_ENTRIES)
+	parser.add_option("--cache-max-size", dest="cache_max_size", type="int", default=cache.DEFAULT_MAX_BYTES / (1024 * 1024),
+						help="The most megabytes of pages to keep cached (default: %d)" % (cache.DEFAULT_MAX_BYTES / (1024 * 1024)))
+	parser.add_option("--cache-prune", dest="cache_prune", action="store_true",
+						help="Remove expired pages and pages over the cache limits, then exit")
+	parser.add_option("--cache-stats", dest="cache_stats", action="store_true",
+						help="Print the size of the page cache, then exit")
+	parser.add_option("--compress-cache", dest="compress_cache", action="store_true",
+						help="Store cached pages compressed with gzip")
 	parser.add_option("-c", "--config", dest="config", help="The config file to use (default: config.ini)",
 						default="config.ini")
+	parser.add_option("-j", "--concurrency", dest="concurrency", type="int", default=fetch.DEFAULT_CONCURRENCY,
+						help="The number of pages to download at once (default: %d)" % fetch.DEFAULT_CONCURRENCY)
+	parser.add_option("-f", "--full", dest="is_full_sync", action="store_true",
+						help="Fetch every ticket instead of only those updated since the last sync")
+	parser.add_option("--idle-timeout", dest="idle_timeout", type="int", default=network.DEFAULT_IDLE_TIMEOUT,
+						help="Seconds before an idle Lighthouse connection is closed (default: %d)" % network.DEFAULT_IDLE_TIMEOUT)
+	parser.add_option("--metrics", dest="show_metrics", action="store_true",
+						help="Print how long each phase of the sync took when it's done")
+	parser.add_option("--metrics-report", dest="metrics_report",
+						help="Write the timings and counters of the sync to this JSON file")
+	parser.add_option("-n", "--dry-run", dest="is_dry_run", action="store_true",
+						help="Print the changes that would be made in Things without making them")
+	parser.add_option("--pool-size", dest="pool_size", type="int", default=network.DEFAULT_POOL_SIZE,
+						help="Idle Lighthouse connections to keep open (default: %d)" % network.DEFAULT_POOL_SIZE)
+	parser.add_option("--rebuild-state", dest="rebuild_state", action="store_true",
+						help="Forget what was synced before and compare every ticket with Things")
 	parser.add_option("-t", "--token", dest="token", help="Your Lighthouse token")					
 	parser.add_option("-v", "--verbose", dest="is_verbose", action="store_true",
 						help="Display verbose text")
+	parser.add_option("-w", "--worker", dest="use_worker", action="store_true",
+						help="Run all AppleScript in one long-lived osascript process")
+	parser.add_option("--worker-command", dest="worker_command",
+						help="The command that starts the AppleScript worker (implies --worker)")
 
 	(options, args) = parser.parse_args()
 
+	network.cache = cache.Cache(Lighthouse.cache_path, Lighthouse.cache_expiration_seconds,
+		options.cache_max_size * 1024 * 1024, options.cache_max_entries, options.cache_max_age)
+
+	if options.cache_prune or options.cache_stats:
+		if options.cache_prune:
+			(removed, freed) = network.cache.prune()
+			print "Removed %d cached pages (%.1f MB)" % (removed, freed / (1024.0 * 1024.0))
+		if options.cache_stats:
+			print_cache_stats(network.cache.stats())
+		network.cache.close()
+		sys.exit(0)
+
 	config = Config(options)
 
 	config.log("Your configuration settings:")
@@ -206,9 +467,38 @@ if __name__ == "__main__":
 	config.log("Lighthouse Base URL: " + config.base_url())
 	config.log()
 	
-	l = Lighthouse(config)
+	if options.use_worker or options.worker_command is not None:
+		command = None
+		if options.worker_command is not None:
+			command = shlex.split(options.worker_command)
+		things.set_transport(things.WorkerTransport(command))
+
+	network.pool = network.ConnectionPool(options.pool_size, options.idle_timeout)
+
+	sync_state = state.SyncState(Lighthouse.state_path)
+	if options.rebuild_state:
+		config.log("Rebuilding the sync state...")
+		sync_state.rebuild()
+		# A dry run compares every ticket, but leaves the stored state as it was.
+		if not config.is_dry_run:
+			sync_state.commit()
+
+	l = Lighthouse(config, sync_state)
 	l.update_projects()
 	
-	things.log_completed_tickets()
+	if not config.is_dry_run:
+		things.log_completed_tickets()
+
+	things.transport.close()
+	network.pool.close()
+	network.cache.close()
+	sync_state.close()
+
+	if options.show_metrics:
+		print
+		for line in metrics.registry.summary():
+			print line
+	if options.metrics_report is not None:
+		metrics.registry.write_report(options.metrics_report)
 	
 	
\ No newline at end of file
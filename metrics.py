@@ -0,0 +1,172 @@
+#
+#  metrics.py
+#  Timings and counters for each phase of a sync.
+#
+#  Each phase records how long it took under a name such as http.request or
+#  things.script, and events such as cache hits are counted. At the end of a run
+#  the keeper can print a summary table and write every timing, counter and
+#  latency histogram to a JSON report, to tell whether Lighthouse or Things is
+#  the bottleneck and to compare one run with the next.
+#
+#  Usage:
+#    started = metrics.start()
+#    ...
+#    metrics.stop('xml.parse', started)
+#    metrics.count('cache.hit')
+#
+#  Copyright 2010 Jeff Verkoeyen. Licensed under the Apache License, Version 2.0.
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+
+import json
+import threading
+import time
+
+# The upper bounds, in milliseconds, of the buckets of every latency histogram.
+# Slower timings fall in a last bucket of their own.
+LATENCY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+class Timing(object):
+	"""The number, total, fastest and slowest of a phase's timings, and their histogram."""
+
+	def __init__(self):
+		self.count = 0
+		self.total = 0.0
+		self.min = None
+		self.max = None
+		self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+	def add(self, seconds):
+		self.count += 1
+		self.total += seconds
+		if self.min is None or seconds < self.min:
+			self.min = seconds
+		if self.max is None or seconds > self.max:
+			self.max = seconds
+
+		milliseconds = seconds * 1000
+		index = 0
+		while index < len(LATENCY_BUCKETS) and milliseconds > LATENCY_BUCKETS[index]:
+			index += 1
+		self.buckets[index] += 1
+
+	def mean(self):
+		if self.count == 0:
+			return 0.0
+		return self.total / self.count
+
+	def histogram(self):
+		"""(label, count) for each bucket, such as ('<= 5 ms', 12) and ('> 5000 ms', 1)."""
+
+		labels = ['<= %d ms' % bound for bound in LATENCY_BUCKETS] + ['> %d ms' % LATENCY_BUCKETS[-1]]
+		return zip(labels, self.buckets)
+
+	def report(self):
+		return {
+			'count': self.count,
+			'total_seconds': self.total,
+			'mean_seconds': self.mean(),
+			'min_seconds': self.min,
+			'max_seconds': self.max,
+			'histogram': [{'bucket': label, 'count': count} for (label, count) in self.histogram()],
+		}
+
+class Metrics(object):
+	"""The timings and counters recorded during a run. Every method can be called from any thread."""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		self.lock.acquire()
+		self.started_at = time.time()
+		self.timings = {}
+		self.counters = {}
+		self.lock.release()
+
+	def add_time(self, name, seconds):
+		self.lock.acquire()
+		timing = self.timings.get(name)
+		if timing is None:
+			timing = self.timings[name] = Timing()
+		timing.add(seconds)
+		self.lock.release()
+
+	def count(self, name, amount=1):
+		self.lock.acquire()
+		self.counters[name] = self.counters.get(name, 0) + amount
+		self.lock.release()
+
+	def report(self):
+		"""Every timing and counter as a dictionary that can be written as JSON."""
+
+		self.lock.acquire()
+		try:
+			return {
+				'started_at': self.started_at,
+				'seconds': time.time() - self.started_at,
+				'timings': dict([(name, timing.report()) for (name, timing) in self.timings.items()]),
+				'counters': dict(self.counters),
+			}
+		finally:
+			self.lock.release()
+
+	def summary(self, histograms=('things.',)):
+		"""The lines of a table of every timing and counter. The latency histograms of the
+		timings whose names start with one of histograms follow the table."""
+
+		self.lock.acquire()
+		try:
+			lines = ["%-32s %8s %10s %10s %10s" % ('Phase', 'Count', 'Total (s)', 'Mean (ms)', 'Max (ms)')]
+			for name in sorted(self.timings):
+				timing = self.timings[name]
+				lines.append("%-32s %8d %10.3f %10.1f %10.1f" % (name, timing.count, timing.total,
+					timing.mean() * 1000, (timing.max or 0.0) * 1000))
+
+			if len(self.counters) > 0:
+				lines.append("")
+				lines.append("%-32s %8s" % ('Counter', 'Count'))
+				for name in sorted(self.counters):
+					lines.append("%-32s %8d" % (name, self.counters[name]))
+
+			for name in sorted(self.timings):
+				if not name.startswith(histograms):
+					continue
+				lines.append("")
+				lines.append("%s latency:" % (name))
+				for (label, count) in self.timings[name].histogram():
+					if count > 0:
+						lines.append("  %-12s %8d" % (label, count))
+
+			lines.append("")
+			lines.append("Total run time: %.3f s" % (time.time() - self.started_at))
+			return lines
+		finally:
+			self.lock.release()
+
+	def write_report(self, path):
+		f = open(path, 'w')
+		json.dump(self.report(), f, indent=1, sort_keys=True)
+		f.close()
+
+# The metrics of this run.
+registry = Metrics()
+
+def start():
+	"""The time a phase started, to pass to stop."""
+
+	return time.time()
+
+def stop(name, started):
+	"""Record the time since started under name. Returns the seconds it took."""
+
+	seconds = time.time() - started
+	registry.add_time(name, seconds)
+	return seconds
+
+def add_time(name, seconds):
+	registry.add_time(name, seconds)
+
+def count(name, amount=1):
+	registry.count(name, amount)
@@ -9,73 +9,400 @@
 #  http://www.apache.org/licenses/LICENSE-2.0
 #
 
+from cache import Cache
 from keeper import Lighthouse
 from urllib2 import HTTPError
 import BeautifulSoup
-import hashlib
+import httplib
+import metrics
 import os
+import socket
+import threading
 import time
-import urllib2
+import urlparse
+import zlib
 
-def url_to_cache_path(url):
-	hash = hashlib.sha224(url).hexdigest()
-	return os.path.join(Lighthouse.cache_path, hash)
+DEFAULT_POOL_SIZE = 4
+DEFAULT_IDLE_TIMEOUT = 30
+MAX_REDIRECTS = 5
 
-def cache_check(url):
-	cache_path = url_to_cache_path(url)
+class ConnectionPool(object):
+	"""Keeps persistent HTTP connections per host and reuses them for every request.
 
-	if os.path.isfile(cache_path):
-		return (time.time() - os.stat(cache_path).st_mtime) < Lighthouse.cache_expiration_seconds
-	else:
-		return False
+	At most max_connections idle connections are kept per host, and connections that
+	have been idle for more than idle_timeout seconds are closed instead of reused."""
 
-def cache_get(url):
-	cache_path = url_to_cache_path(url)
-	
-	f = open(cache_path, 'r')
-	data = f.read()
-	f.close()
+	def __init__(self, max_connections=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+		self.max_connections = max_connections
+		self.idle_timeout = idle_timeout
+		self.idle = {}
+		self.lock = threading.Lock()
+		self.connections_opened = 0
 
-	return data
+	def acquire(self, key):
+		"""An idle connection to the host, or None. Expired connections are closed."""
 
-def cache_put(url, data):
-	cache_path = url_to_cache_path(url)
-	
-	f = open(cache_path, 'w')
-	f.write(data)
-	f.close()
+		self.lock.acquire()
+		try:
+			connections = self.idle.get(key, [])
+			while len(connections) > 0:
+				(connection, idle_since) = connections.pop()
+				if time.time() - idle_since < self.idle_timeout:
+					return connection
+				connection.close()
+			return None
+		finally:
+			self.lock.release()
 
-def get_xml(endpoint, config):
-	url = os.path.join(config.base_url(), endpoint)
-	
-	data = None
-	if not cache_check(url):
-		config.log("Sending request to " + url)
+	def release(self, key, connection):
+		self.lock.acquire()
+		try:
+			connections = self.idle.setdefault(key, [])
+			if len(connections) < self.max_connections:
+				connections.append((connection, time.time()))
+				connection = None
+		finally:
+			self.lock.release()
+		if connection is not None:
+			connection.close()
+
+	def connect(self, key):
+		(scheme, host) = key
+		self.lock.acquire()
+		self.connections_opened += 1
+		self.lock.release()
+		if scheme == 'https':
+			return httplib.HTTPSConnection(host)
+		return httplib.HTTPConnection(host)
+
+	def request(self, url, headers):
+		"""GET the url, following redirects. Returns (status, headers, body).
+
+		Raises urllib2.HTTPError for error responses, like urllib2.urlopen."""
+
+		for i in range(MAX_REDIRECTS + 1):
+			(status, response_headers, body) = self.get(url, headers)
+			if status in (301, 302, 303, 307) and response_headers.getheader('location') is not None:
+				url = urlparse.urljoin(url, response_headers.getheader('location'))
+				continue
+			if status >= 400:
+				raise HTTPError(url, status, httplib.responses.get(status, ''), response_headers, None)
+			return (status, response_headers, body)
+		raise HTTPError(url, status, "Too many redirects", response_headers, None)
+
+	def get(self, url, headers):
+		"""GET the url once. Returns (status, headers, body)."""
+
+		headers = dict(headers)
+		headers.setdefault('Accept-Encoding', 'gzip')
+
+		parts = urlparse.urlsplit(url)
+		key = (parts.scheme, parts.netloc)
+		path = parts.path or '/'
+		if parts.query:
+			path += '?' + parts.query
 
-		headers = { 
-			'X-LighthouseToken' : config['token'],
-		}
-		req = urllib2.Request(url, None, headers)	
+		connection = self.acquire(key)
+		is_reused = connection is not None
+		while True:
+			if connection is None:
+				connection = self.connect(key)
+			try:
+				connection.request('GET', path, None, headers)
+				response = connection.getresponse()
+				body = response.read()
+				break
+			except (httplib.HTTPException, socket.error):
+				connection.close()
+				connection = None
+				# The server may have closed an idle connection; retry once on a new one.
+				if not is_reused:
+					raise
+				is_reused = False
 
+		if response.will_close:
+			connection.close()
+		else:
+			self.release(key, connection)
+
+		if response.getheader('content-encoding', '').lower() == 'gzip':
+			body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+		return (response.status, response.msg, body)
+
+	def close(self):
+		self.lock.acquire()
 		try:
-			response = urllib2.urlopen(req)
-			xml = response.read()
-		except HTTPError as exception:
-			config.log("There was an error fetching the data.")
-			config.log(exception)
-			config.log()
-			exit
+			for connections in self.idle.values():
+				for (connection, idle_since) in connections:
+					connection.close()
+			self.idle = {}
+		finally:
+			self.lock.release()
+
+pool = ConnectionPool()
+
+# The page cache. keeper.py replaces it with one that has the configured limits.
+cache = Cache(Lighthouse.cache_path, Lighthouse.cache_expiration_seconds)
+
+# The response headers stored with a cached page and the request headers that revalidate it.
+validators = [
+	('etag', 'If-None-Match'),
+	('last-modified', 'If-Modified-Since'),
+]
+
+def response_charset(response_headers):
+	"""The charset named by a response's Content-Type header, or None."""
+
+	content_type = response_headers.getheader('content-type')
+	if content_type is None:
+		return None
+	for parameter in content_type.split(';')[1:]:
+		(name, equals, value) = parameter.partition('=')
+		if name.strip().lower() == 'charset':
+			return value.strip().strip('"\'') or None
+	return None
+
+def download_xml(url, config):
+	"""Download url, revalidating the cached copy if there is one, and cache the result.
+	Returns (xml, the charset the response was sent in, or None)."""
 
-		cache_put(url, xml)
+	config.log("Sending request to " + url)
+
+	headers = { 
+		'X-LighthouseToken' : config['token'],
+	}
+
+	# A stale cached copy is revalidated instead of downloaded again.
+	metadata = cache.get_metadata(url)
+	for (name, header) in validators:
+		if metadata.get(name) is not None:
+			headers[header] = metadata[name]
+
+	try:
+		started = metrics.start()
+		(status, response_headers, xml) = pool.request(url, headers)
+		metrics.stop('http.request', started)
+	except HTTPError as exception:
+		config.log("There was an error fetching the data.")
+		config.log(exception)
+		config.log()
+		# Nothing was fetched, so there's nothing to cache or parse.
+		raise
+
+	if status == 304:
+		metrics.count('http.not_modified')
+		cache.touch(url)
+		xml = cache.get(url)
+		if xml is not None:
+			config.log("Not modified, loaded from cache!")
+		else:
+			# The entry was evicted after its validators were read.
+			started = metrics.start()
+			(status, response_headers, xml) = pool.request(url, { 'X-LighthouseToken' : config['token'] })
+			metrics.stop('http.request', started)
+
+	if status != 304:
+		metadata = {}
+		for (name, header) in validators:
+			metadata[name] = response_headers.getheader(name)
+		# Parsing the page again from the cache then needn't sniff its encoding.
+		metadata['charset'] = response_charset(response_headers)
+		cache.put(url, xml, metadata, config.compress_cache)
+		metrics.count('http.bytes', len(xml))
 
 		config.log("Fetched!")
-		
-	else:
+
+	return (xml, metadata.get('charset'))
+
+def get_xml(endpoint, config):
+	"""The page at endpoint, from the cache if it's fresh there. Returns (xml, the
+	charset it was sent in, or None), to pass to xml_to_data or RecordReader."""
+
+	url = os.path.join(config.base_url(), endpoint)
+	started = metrics.start()
+	
+	xml = None
+	encoding = None
+	if cache.is_fresh(url):
 		config.log("Loading from cache...")
-		xml = cache_get(url)
-		config.log("Loaded!")
+		xml = cache.get(url)
+		if xml is not None:
+			config.log("Loaded!")
+			metrics.count('cache.hit')
+			encoding = cache.get_metadata(url).get('charset')
+
+	if xml is None:
+		# Only one thread or process downloads a page at a time. The others wait, then
+		# find it in the cache.
+		lock = cache.lock_entry(url)
+		try:
+			if cache.is_fresh(url):
+				config.log("Downloaded by another request, loading from cache...")
+				xml = cache.get(url)
+				if xml is not None:
+					metrics.count('cache.hit')
+					encoding = cache.get_metadata(url).get('charset')
+			if xml is None:
+				metrics.count('cache.miss')
+				(xml, encoding) = download_xml(url, config)
+		finally:
+			cache.unlock_entry(lock)
 
-	return xml
+	metrics.stop('http.get_xml', started)
+	return (xml, encoding)
 	
-def xml_to_data(xml):
-	return BeautifulSoup.BeautifulStoneSoup(xml)
+class StrainedSoup(BeautifulSoup.BeautifulStoneSoup):
+	"""A BeautifulStoneSoup that only keeps the fields of each record that it's told to.
+
+	Records are the children of the document's top-level element. When fields is
+	given, a record's child elements are kept only if their name is in fields, so
+	nested data such as a ticket's versions is never built. skipped counts the
+	elements, nested ones included, that were left out.
+
+	Lighthouse's XML is well-formed, so it's split into tokens with BeautifulSoup's
+	XML_TOKENIZER rather than sgmllib, which builds the same tree faster, and it's
+	parsed strictly: no tag closes another, and unbalanced tags raise
+	BeautifulSoup.UnbalancedTagError rather than being fixed up."""
+
+	tokenizer = BeautifulSoup.XML_TOKENIZER
+	strict = True
+	# The keeper never renames a tag, so finding fields by name can use an index.
+	useNameIndex = True
+
+	def __init__(self, markup="", fields=None, encoding=None):
+		self.strainer = None
+		if fields is not None:
+			self.strainer = BeautifulSoup.SoupStrainer(list(fields))
+		BeautifulSoup.BeautifulStoneSoup.__init__(self, markup, fromEncoding=encoding)
+
+	def reset(self):
+		self.skipping = []
+		self.skipped = 0
+		BeautifulSoup.BeautifulStoneSoup.reset(self)
+
+	def is_open(self, name):
+		for tag in self.tagStack:
+			if tag.name == name:
+				return True
+		return False
+
+	def unknown_starttag(self, name, attrs, selfClosing=0):
+		if not self.skipping:
+			# Unless the soup is strict, a tag named like an open tag closes it, so it's
+			# left to BeautifulSoup.
+			if (self.strainer is None or len(self.tagStack) != 3 or self.strainer.searchTag(name, attrs)
+					or (not self.strict and self.is_open(name))):
+				return BeautifulSoup.BeautifulStoneSoup.unknown_starttag(self, name, attrs, selfClosing)
+			self.endData()
+		self.skipping.append(name)
+		self.skipped += 1
+
+	def unknown_endtag(self, name):
+		if self.skipping and self.strict:
+			if name != self.skipping[-1]:
+				raise BeautifulSoup.UnbalancedTagError("</%s> doesn't close <%s>" % (name, self.skipping[-1]))
+			self.skipping.pop()
+			return
+		if self.skipping:
+			if name in self.skipping:
+				while self.skipping.pop() != name:
+					pass
+				return
+			if not self.is_open(name):
+				return
+			# The end of the record closes whatever was left open in it.
+			self.skipping = []
+		BeautifulSoup.BeautifulStoneSoup.unknown_endtag(self, name)
+
+	def handle_data(self, data):
+		if not self.skipping:
+			self.currentData.append(data)
+
+def xml_to_data(xml, fields=None, encoding=None):
+	"""The tree of xml. When fields is given, only those children of each record are built.
+	xml is decoded with encoding if it's given, such as the charset get_xml returns."""
+
+	started = metrics.start()
+	data = StrainedSoup(xml, fields, encoding)
+	metrics.stop('xml.parse', started)
+	return data
+
+# The number of characters handed to the record reader's parser at a time.
+READ_CHUNK_SIZE = 64 * 1024
+
+class RecordReader(StrainedSoup):
+	"""Reads the record_name elements of a Lighthouse array one at a time.
+
+	Each record is flattened into a dictionary of child element name to the
+	element's string, as Tag.string would return it, as soon as its closing tag
+	is parsed. The record's tree is then dropped, so only one record is in memory
+	at a time rather than the whole document. fields limits the fields that are
+	read and encoding decodes the markup, as in StrainedSoup."""
+
+	def __init__(self, record_name, fields=None, encoding=None):
+		self.record_name = record_name
+		self.records = []
+		self.record_count = 0
+		StrainedSoup.__init__(self, "", fields, encoding)
+
+	def popTag(self):
+		tag = self.currentTag
+		parent = StrainedSoup.popTag(self)
+		# Records are the children of the document's top-level element.
+		if tag.name == self.record_name and len(self.tagStack) == 2:
+			record = {}
+			for node in tag.contents:
+				if not isinstance(node, BeautifulSoup.Tag):
+					continue
+				string = node.string
+				if string is not None:
+					string = unicode(string)
+				record[node.name] = string
+			self.records.append(record)
+			self.record_count += 1
+
+			# Forget the record and the text around it.
+			del parent.contents[:]
+			parent.next = None
+			self.previous = parent
+		return parent
+
+	def read(self, markup, chunk_size=READ_CHUNK_SIZE):
+		"""Parse the markup, yielding each record as soon as it has been parsed.
+
+		The time spent parsing, but not the time the caller spends on each record, is
+		recorded as one xml.parse timing once the whole document has been read."""
+
+		started = metrics.start()
+		# Decoded and massaged the same way BeautifulStoneSoup._feed does it.
+		if not isinstance(markup, unicode):
+			markup = BeautifulSoup.UnicodeDammit(markup, [self.fromEncoding],
+				smartQuotesTo=self.smartQuotesTo).unicode
+		for fix, m in self.defaultMarkupMassage():
+			markup = fix.sub(m, markup)
+
+		seconds = 0.0
+		for start in range(0, len(markup), chunk_size):
+			BeautifulSoup.SGMLParser.feed(self, markup[start:start + chunk_size])
+			seconds += time.time() - started
+			for record in self.take_records():
+				yield record
+			started = metrics.start()
+
+		if not self.strict:
+			BeautifulSoup.SGMLParser.close(self)
+		self.closeOpenTags()
+		metrics.add_time('xml.parse', seconds + time.time() - started)
+		metrics.count('xml.records', self.record_count)
+		for record in self.take_records():
+			yield record
+
+	def take_records(self):
+		records = self.records
+		self.records = []
+		return records
+
+def xml_to_records(xml, record_name, fields=None, encoding=None):
+	"""The record_name elements of xml as dictionaries of field name to string, one at a time."""
+
+	return RecordReader(record_name, fields, encoding).read(xml)
@@ -0,0 +1,147 @@
+#
+#  reconcile.py
+#  Compares Lighthouse tickets with the last-known Things state and plans the
+#  smallest set of Things writes that brings Things up-to-date.
+#
+#  Copyright 2010 Jeff Verkoeyen. Licensed under the Apache License, Version 2.0.
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+
+import re
+import things
+
+CREATE = 'create'
+UPDATE = 'update'
+COMPLETE = 'complete'
+
+# Ticket.name() ends with the ticket number, which stays the same when a ticket is renamed.
+number_regex = re.compile(r'\(Lighthouse number: (\d+)\)$')
+
+class Change(object):
+	"""A single planned write to Things.
+
+	For CREATE and UPDATE changes, fields maps the Things properties to write
+	('name', 'notes' and 'tags') to their new values. A CREATE change of a resolved
+	ticket is_completed, as the to do is created completed."""
+
+	def __init__(self, kind, ticket, to_do=None, fields=None, is_completed=False):
+		self.kind = kind
+		self.ticket = ticket
+		self.to_do = to_do
+		self.fields = fields or {}
+		self.is_completed = is_completed
+
+	def describe(self):
+		if self.kind == CREATE and self.is_completed:
+			return "Create \"%s\" as completed" % (self.ticket.name())
+		elif self.kind == CREATE:
+			return "Create \"%s\"" % (self.ticket.name())
+		elif self.kind == COMPLETE:
+			return "Complete \"%s\"" % (self.ticket.name())
+		return "Update %s of \"%s\"" % (', '.join(sorted(self.fields.keys())), self.to_do.name)
+
+def index_by_number(snapshot):
+	"""Map Lighthouse ticket numbers to the to dos in a snapshot."""
+
+	to_dos = {}
+	for to_do in snapshot.values():
+		match = number_regex.search(to_do.name)
+		if match:
+			to_dos[match.group(1)] = to_do
+	return to_dos
+
+def index_by_id(snapshot):
+	"""Map Things ids to the to dos in a snapshot, which is already keyed by id."""
+
+	return dict(snapshot)
+
+def normalize_notes(notes):
+	if notes is None:
+		return ""
+	return notes.replace('\r\n', '\n').replace('\r', '\n').strip()
+
+def ticket_notes(ticket):
+	"""The Things notes for a ticket, as written by things.create_ticket."""
+
+	body = ticket['original-body']
+	if body is None:
+		body = ""
+	url = ticket['url']
+	if url is None:
+		url = ""
+	return body + "\nLighthouse URL: " + url
+
+def plan_ticket(ticket, to_do):
+	"""The changes that bring to_do (None if it doesn't exist yet) in line with the ticket."""
+
+	changes = []
+	tags = things.clean_tags(ticket['tag'])
+	is_resolved = ticket['state'] == 'resolved'
+
+	if to_do is None:
+		fields = {}
+		if len(things.tag_set(tags)) > 0:
+			fields['tags'] = ticket['tag']
+		changes.append(Change(CREATE, ticket, None, fields, is_resolved))
+	else:
+		fields = {}
+		if to_do.name != ticket.name():
+			fields['name'] = ticket.name()
+		if normalize_notes(to_do.notes) != normalize_notes(ticket_notes(ticket)):
+			fields['notes'] = ticket_notes(ticket)
+		if things.tag_set(to_do.tags) != things.tag_set(tags):
+			fields['tags'] = ticket['tag']
+		if len(fields) > 0:
+			changes.append(Change(UPDATE, ticket, to_do, fields))
+
+		if is_resolved and not to_do.is_completed():
+			changes.append(Change(COMPLETE, ticket, to_do))
+
+	return changes
+
+def match(ticket, to_dos, to_dos_by_id=None, things_id=None):
+	"""The ticket's to do in to_dos (as made by index_by_number), or None.
+
+	If the to do with the ticket's stored Things id is still in to_dos_by_id (as
+	made by index_by_id), it's used even if its name no longer has the ticket's
+	number. The to do's Things id is remembered on the ticket."""
+
+	to_do = None
+	if things_id is not None and to_dos_by_id is not None:
+		to_do = to_dos_by_id.get(things_id)
+	if to_do is None:
+		to_do = to_dos.get(ticket['number'])
+	if to_do is not None:
+		ticket.things_id = to_do.things_id
+	return to_do
+
+def plan(tickets, snapshot):
+	"""The changes that bring the to dos in snapshot in line with the tickets.
+
+	To dos are matched to tickets by Lighthouse number, so renamed tickets are
+	updated rather than created again."""
+
+	to_dos = index_by_number(snapshot)
+	changes = []
+	for ticket in tickets:
+		changes.extend(plan_ticket(ticket, match(ticket, to_dos)))
+	return changes
+
+def execute(changes, project_name, batch):
+	"""Queue the changes in the batch. Returns (change, operation) for each queued operation.
+
+	Existing to dos are addressed by id, and a new to do is created with its tags and
+	status, so no write has to find a to do by name."""
+
+	operations = []
+	for change in changes:
+		ticket = change.ticket
+		if change.kind == CREATE:
+			operations.append((change, things.create_ticket(project_name, ticket.name(), ticket['original-body'], ticket['url'],
+				change.fields.get('tags'), change.is_completed, batch)))
+		elif change.kind == UPDATE:
+			operations.append((change, things.update_ticket_by_id(change.to_do.things_id,
+				change.fields.get('name'), change.fields.get('notes'), change.fields.get('tags'), batch)))
+		elif change.kind == COMPLETE:
+			operations.append((change, things.complete_ticket_by_id(change.to_do.things_id, batch)))
+	return operations
@@ -0,0 +1,81 @@
+#
+#  records.py
+#  Compact records for the projects and tickets read from Lighthouse.
+#
+#  A sync builds a record for every ticket it reads and keeps the changed ones
+#  until their batches have run in Things, so a record holds only a fixed list of
+#  fields in a list instead of a dictionary per ticket. Records can still be read
+#  and written like the dictionaries they're built from.
+#
+#  Copyright 2010 Jeff Verkoeyen. Licensed under the Apache License, Version 2.0.
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+
+# One copy of every shared field value, such as 'open' or 'resolved'.
+shared_strings = {}
+
+# The most values that are shared. A field whose values don't repeat would
+# otherwise fill the table with every value read in the run.
+MAX_SHARED_STRINGS = 1000
+
+def share(value):
+	"""The one copy of value that every record uses, or value itself once the table is full."""
+
+	shared = shared_strings.get(value)
+	if shared is not None:
+		return shared
+	if len(shared_strings) < MAX_SHARED_STRINGS:
+		shared_strings[value] = value
+	return value
+
+class Record(object):
+	"""A record with a fixed set of fields, read like a dictionary of field name to string.
+
+	Fields that aren't in fields are dropped. The values of shared_fields repeat
+	from one record to the next, so records share one copy of each. The values of
+	lazy_fields are rarely read, so they're kept encoded as UTF-8, which is a
+	quarter of the size, and only decoded when they're read."""
+
+	__slots__ = ['values']
+	fields = []
+	shared_fields = []
+	lazy_fields = []
+
+	def __init__(self, data):
+		self.values = [None] * len(self.fields)
+		for name in self.fields:
+			self[name] = data.get(name)
+
+	def index(self, name):
+		try:
+			return self.fields.index(name)
+		except ValueError:
+			raise KeyError(name)
+
+	def __getitem__(self, name):
+		value = self.values[self.index(name)]
+		if value is not None and name in self.lazy_fields:
+			value = value.decode('utf-8')
+		return value
+
+	def __setitem__(self, name, value):
+		if value is not None:
+			if name in self.shared_fields:
+				value = share(value)
+			elif name in self.lazy_fields:
+				value = unicode(value).encode('utf-8')
+		self.values[self.index(name)] = value
+
+	def __contains__(self, name):
+		return name in self.fields
+
+	def get(self, name, default=None):
+		if name not in self.fields:
+			return default
+		return self[name]
+
+	def keys(self):
+		return list(self.fields)
+
+	def items(self):
+		return [(name, self[name]) for name in self.fields]
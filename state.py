@@ -0,0 +1,146 @@
+#
+#  state.py
+#  The keeper's memory between runs.
+#
+#  A SQLite database that maps Lighthouse projects and tickets to their Things ids,
+#  along with a hash of the ticket fields that were last synced and the ticket's
+#  updated-at, so that unchanged tickets can be skipped entirely.
+#
+#  Copyright 2010 Jeff Verkoeyen. Licensed under the Apache License, Version 2.0.
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+
+import hashlib
+import sqlite3
+
+# The ticket fields that are written to Things. A change to any of them changes the hash.
+synced_fields = ['title', 'original-body', 'tag', 'state', 'url']
+
+# Each migration brings the schema from version i to i + 1. Never edit a migration
+# that has shipped; append a new one instead.
+migrations = [
+	[
+		"""CREATE TABLE projects (
+			project_id TEXT PRIMARY KEY,
+			things_id TEXT
+		)""",
+		"""CREATE TABLE tickets (
+			project_id TEXT NOT NULL,
+			number TEXT NOT NULL,
+			things_id TEXT,
+			content_hash TEXT,
+			updated_at TEXT,
+			PRIMARY KEY (project_id, number)
+		)""",
+	],
+	[
+		# The newest updated-at of the tickets synced for the project.
+		"ALTER TABLE projects ADD COLUMN updated_at TEXT",
+	],
+]
+
+def content_hash(ticket):
+	"""A hash of the ticket fields that are synced to Things."""
+
+	values = []
+	for name in synced_fields:
+		value = ticket.get(name)
+		if value is None:
+			value = u''
+		values.append(unicode(value).encode('utf-8'))
+	return hashlib.sha1('\0'.join(values)).hexdigest()
+
+class TicketState(object):
+	"""What was stored for a ticket the last time it was synced."""
+
+	def __init__(self, things_id, content_hash, updated_at):
+		self.things_id = things_id
+		self.content_hash = content_hash
+		self.updated_at = updated_at
+
+	def matches(self, ticket):
+		"""Whether the ticket is unchanged since it was last synced."""
+
+		return (self.updated_at == ticket.get('updated-at')
+			and self.content_hash == content_hash(ticket))
+
+class SyncState(object):
+	"""The sync state database at path, migrated to the latest schema when opened."""
+
+	def __init__(self, path):
+		self.path = path
+		self.db = sqlite3.connect(path)
+		self.migrate()
+
+	def version(self):
+		return self.db.execute('PRAGMA user_version').fetchone()[0]
+
+	def migrate(self):
+		version = self.version()
+		for statements in migrations[version:]:
+			for statement in statements:
+				self.db.execute(statement)
+			version += 1
+			self.db.execute('PRAGMA user_version = %d' % version)
+		self.db.commit()
+
+	def rebuild(self):
+		"""Forget everything, so that the next sync compares every ticket with Things.
+
+		Nothing is forgotten for good until commit()."""
+
+		self.db.execute('DELETE FROM tickets')
+		self.db.execute('DELETE FROM projects')
+
+	def forget_project(self, project_id):
+		"""Forget the project's tickets and their newest updated-at, so that the next
+		sync fetches and compares every one of them."""
+
+		self.db.execute('DELETE FROM tickets WHERE project_id = ?', (project_id,))
+		self.db.execute('UPDATE projects SET updated_at = NULL WHERE project_id = ?', (project_id,))
+
+	def get_project(self, project_id):
+		"""The Things id stored for the project, or None."""
+
+		row = self.db.execute('SELECT things_id FROM projects WHERE project_id = ?',
+			(project_id,)).fetchone()
+		if row is None:
+			return None
+		return row[0]
+
+	def put_project(self, project_id, things_id):
+		self.db.execute('INSERT OR IGNORE INTO projects (project_id) VALUES (?)', (project_id,))
+		self.db.execute('UPDATE projects SET things_id = ? WHERE project_id = ?', (things_id, project_id))
+
+	def get_high_water(self, project_id):
+		"""The newest updated-at of the project's synced tickets, or None before the first sync."""
+
+		row = self.db.execute('SELECT updated_at FROM projects WHERE project_id = ?',
+			(project_id,)).fetchone()
+		if row is None:
+			return None
+		return row[0]
+
+	def put_high_water(self, project_id, updated_at):
+		self.db.execute('INSERT OR IGNORE INTO projects (project_id) VALUES (?)', (project_id,))
+		self.db.execute('UPDATE projects SET updated_at = ? WHERE project_id = ?', (updated_at, project_id))
+
+	def get_tickets(self, project_id):
+		"""A dictionary of ticket number to TicketState for every ticket stored for the project."""
+
+		tickets = {}
+		for (number, things_id, hash, updated_at) in self.db.execute(
+				'SELECT number, things_id, content_hash, updated_at FROM tickets WHERE project_id = ?',
+				(project_id,)):
+			tickets[number] = TicketState(things_id, hash, updated_at)
+		return tickets
+
+	def put_ticket(self, project_id, ticket):
+		self.db.execute('INSERT OR REPLACE INTO tickets (project_id, number, things_id, content_hash, updated_at) VALUES (?, ?, ?, ?, ?)',
+			(project_id, ticket['number'], ticket.things_id, content_hash(ticket), ticket.get('updated-at')))
+
+	def commit(self):
+		self.db.commit()
+
+	def close(self):
+		self.db.close()
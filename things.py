@@ -7,147 +7,731 @@
 #  Built based on the following guide:
 #  http://culturedcode.com/things/download/ThingsAppleScriptGuide.pdf
 #
+#  Every method can either run immediately or be queued in a Batch. A batch
+#  sends all of its operations to Things as a single generated script, so a
+#  whole project costs one osascript launch instead of three or four per ticket.
+#
+#  Scripts are run by a transport: either a new osascript process per script, or
+#  one long-lived worker (things/worker.js) that scripts are piped to. A batch can
+#  hand its scripts to a Writer, which runs them on a background thread while the
+#  caller goes on to plan the next ones.
+#
+#  The ids of the projects and to dos that are looked up or created are remembered
+#  for the rest of the run in lookups, so asking for one again doesn't cost a script.
+#  Every write also has a _by_id variant that addresses the object by its Things id,
+#  which Things finds without searching by name and which can't match a duplicate.
+#
 #  Created by Jeff Verkoeyen on 2010-10-01.
 #  Copyright 2010 Jeff Verkoeyen. Licensed under the Apache License, Version 2.0.
 #  http://www.apache.org/licenses/LICENSE-2.0
 #
 
+import Queue
+import metrics
 import os
 import subprocess
+import sys
+import threading
+
+DEFAULT_BATCH_SIZE = 50
+
+# How many full batches may wait for a Writer before Batch.add blocks.
+DEFAULT_PENDING_BATCHES = 2
+
+# The AppleScript error number for "Can't get <object>", i.e. the object doesn't exist.
+MISSING_ERROR = '(-1728)'
+
+# Separators used to pull each operation's result back out of osascript's stdout.
+RESULT_SEPARATOR = '\x1e'
+FIELD_SEPARATOR = '\x1f'
+
+# Separators used within a snapshot of a project's to dos.
+TO_DO_SEPARATOR = '\x1d'
+PROPERTY_SEPARATOR = '\x1c'
+
+class Operation(object):
+	"""A single Things command.
+
+	script is an AppleScript fragment that runs inside a tell block and stores its
+	return value in opResult. After the operation has run, result holds the
+	parsed value and error holds the AppleScript error message, if any.
+	callback(operation), if given, is called once the operation has run. name is
+	what the operation's timings are recorded as in metrics, such as things.create_ticket."""
+
+	def __init__(self, script, parse=None, missing_ok=False, callback=None, name=None):
+		self.script = script
+		self.name = name
+		self.parse = parse
+		self.missing_ok = missing_ok
+		self.callback = callback
+		self.result = None
+		self.error = None
+		self.is_done = False
+
+	def finish(self, value=None, error=None):
+		self.error = error
+
+		if error is not None:
+			if not (self.missing_ok and error.find(MISSING_ERROR) >= 0):
+				print "Unhandled error:"
+				print "'" + error + "'"
+			self.result = None
+		elif self.parse is not None:
+			self.result = self.parse(value)
+		else:
+			self.result = value.strip()
+
+		if self.callback is not None:
+			self.callback(self)
+
+		# Set last: a Writer finishes operations on its own thread.
+		self.is_done = True
+
+	def is_missing(self):
+		"""Whether the operation failed because the object it refers to doesn't exist."""
+
+		return self.error is not None and self.error.find(MISSING_ERROR) >= 0
+
+class ToDo(object):
+	"""The state of a single Things to do, as read by get_project_snapshot."""
+
+	def __init__(self, name, things_id, status, tags, notes):
+		self.name = name
+		self.things_id = things_id
+		self.status = status
+		self.tags = tags
+		self.notes = notes
+
+	def is_completed(self):
+		return self.status == 'completed'
+
+class Batch(object):
+	"""Queues operations and sends them to Things in scripts of at most size operations.
+
+	Operations run in the order they were added. Call flush() to run whatever is
+	still queued; the results are then available on each Operation. With a writer,
+	the scripts are run by the writer instead, and the results are available once
+	each Operation is_done or writer.wait() returns."""
+
+	def __init__(self, size=DEFAULT_BATCH_SIZE, writer=None):
+		self.size = max(1, size)
+		self.writer = writer
+		self.pending = []
+
+	def add(self, operation):
+		self.pending.append(operation)
+		if len(self.pending) >= self.size:
+			self.flush()
+		return operation
+
+	def flush(self):
+		while len(self.pending) > 0:
+			operations = self.pending[:self.size]
+			del self.pending[:self.size]
+			if self.writer is not None:
+				self.writer.submit(operations)
+			else:
+				run_operations(operations)
+
+class Writer(object):
+	"""Runs scripts of operations on a background thread, in the order they're submitted.
+
+	At most max_pending scripts wait to be run; submit blocks until there's room,
+	so a caller that plans faster than Things can run never gets far ahead."""
+
+	def __init__(self, max_pending=DEFAULT_PENDING_BATCHES):
+		self.queue = Queue.Queue(max(1, max_pending))
+		self.thread = threading.Thread(target=self.work)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def work(self):
+		while True:
+			operations = self.queue.get()
+			if operations is None:
+				self.queue.task_done()
+				return
+			try:
+				run_operations(operations)
+			except Exception:
+				error = str(sys.exc_info()[1])
+				for operation in operations:
+					if not operation.is_done:
+						operation.finish(error=error)
+			self.queue.task_done()
+
+	def submit(self, operations):
+		# Time spent waiting for Things rather than planning.
+		started = metrics.start()
+		self.queue.put(operations)
+		metrics.stop('things.wait', started)
+
+	def wait(self):
+		"""Wait until every submitted operation has run."""
+
+		started = metrics.start()
+		self.queue.join()
+		metrics.stop('things.wait', started)
+
+	def close(self):
+		self.queue.put(None)
+		self.thread.join()
+
+def quote(text):
+	"""Escape text for use within an AppleScript string literal."""
+
+	if text is None:
+		return ""
+	return text.replace('\\', '\\\\').replace('"', '\\"')
+
+def build_script(operations):
+	"""Generate one AppleScript that runs each operation and reports its result."""
+
+	lines = [
+		'set recordSeparator to character id %d' % ord(RESULT_SEPARATOR),
+		'set fieldSeparator to character id %d' % ord(FIELD_SEPARATOR),
+		'set toDoSeparator to character id %d' % ord(TO_DO_SEPARATOR),
+		'set propertySeparator to character id %d' % ord(PROPERTY_SEPARATOR),
+		'set keeperResults to ""',
+		'tell application "Things"',
+	]
+	for index, operation in enumerate(operations):
+		lines.append('\t-- keeper operation %d' % index)
+		lines.append('\ttry')
+		lines.append('\t\tset opResult to ""')
+		# Fragments are not re-indented: their string literals may span lines.
+		lines.append(operation.script.strip('\n'))
+		lines.append('\t\tset keeperResults to keeperResults & "%d" & fieldSeparator & "ok" & fieldSeparator & (opResult as text) & recordSeparator' % index)
+		lines.append('\ton error errorMessage number errorNumber')
+		lines.append('\t\tset keeperResults to keeperResults & "%d" & fieldSeparator & "error" & fieldSeparator & errorMessage & " (" & errorNumber & ")" & recordSeparator' % index)
+		lines.append('\tend try')
+	lines.append('end tell')
+	lines.append('keeperResults')
+	return '\n'.join(lines)
+
+def parse_results(stdout):
+	"""Split a batch's stdout into a dictionary of operation index to (status, value)."""
+
+	results = {}
+	for record in stdout.split(RESULT_SEPARATOR):
+		fields = record.lstrip('\n').split(FIELD_SEPARATOR, 2)
+		if len(fields) != 3:
+			continue
+		(index, status, value) = fields
+		try:
+			results[int(index)] = (status, value)
+		except ValueError:
+			continue
+	return results
+
+class SubprocessTransport(object):
+	"""Runs every script in a new osascript process."""
+
+	def run(self, cmd):
+		if isinstance(cmd, unicode):
+			cmd = cmd.encode('utf-8')
+		p = subprocess.Popen(['osascript', '-e', cmd], shell=False,
+		 	stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		return p.communicate()
+
+	def close(self):
+		pass
+
+class WorkerTransport(object):
+	"""Runs every script in one long-lived worker process.
+
+	Scripts are written to the worker's stdin as "<length>\n<script>" and results are
+	read back from its stdout as "<ok|error> <length>\n<payload>", lengths in bytes.
+	If the worker can't be started or dies, scripts are run by the fallback transport."""
+
+	def __init__(self, command=None, fallback=None):
+		if command is None:
+			command = ['osascript', '-l', 'JavaScript', WORKER_SCRIPT_PATH]
+		if fallback is None:
+			fallback = SubprocessTransport()
+		self.command = command
+		self.fallback = fallback
+		self.process = None
+		self.is_broken = False
+
+	def start(self):
+		try:
+			self.process = subprocess.Popen(self.command, shell=False,
+				stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+		except OSError as exception:
+			print "Unable to start the Things worker, falling back to osascript per script:"
+			print exception
+			self.is_broken = True
+
+	def run(self, cmd):
+		if self.process is None and not self.is_broken:
+			self.start()
+		if self.is_broken:
+			return self.fallback.run(cmd)
+
+		if isinstance(cmd, unicode):
+			cmd = cmd.encode('utf-8')
+
+		try:
+			self.process.stdin.write('%d\n' % len(cmd))
+			self.process.stdin.write(cmd)
+			self.process.stdin.flush()
+
+			header = self.process.stdout.readline()
+			(status, length) = header.split()
+			payload = self.process.stdout.read(int(length))
+			if len(payload) != int(length):
+				raise IOError("Truncated result from the Things worker")
+		except (IOError, ValueError) as exception:
+			print "The Things worker failed, falling back to osascript per script:"
+			print exception
+			self.close()
+			self.is_broken = True
+			return self.fallback.run(cmd)
+
+		if status == 'ok':
+			return (payload, '')
+		return ('', payload)
+
+	def close(self):
+		if self.process is not None:
+			try:
+				self.process.stdin.close()
+				self.process.wait()
+			except (IOError, OSError):
+				pass
+			self.process = None
+
+# The JavaScript for Automation worker run by WorkerTransport.
+WORKER_SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'things', 'worker.js')
+
+transport = SubprocessTransport()
+
+# Scripts run one at a time, whichever thread they come from.
+transport_lock = threading.Lock()
+
+def set_transport(new_transport):
+	"""Use new_transport for all following scripts, closing the current one."""
+
+	global transport
+	transport.close()
+	transport = new_transport
+
+def run_script(cmd):
+	"""Run the given AppleScript with the current transport. Returns (stdout, stderr)."""
+
+	transport_lock.acquire()
+	try:
+		return transport.run(cmd)
+	finally:
+		transport_lock.release()
+
+def run_operations(operations):
+	"""Run the operations as one script and hand each one its result."""
+
+	started = metrics.start()
+	(stdout, stderr) = run_script(build_script(operations))
+	seconds = metrics.stop('things.script', started)
+	metrics.count('things.operations', len(operations))
+	# Each operation is charged an equal share of the script, so the totals of the
+	# operations add up to the time spent in Things.
+	share = seconds / len(operations)
+	for operation in operations:
+		if operation.name is not None:
+			metrics.add_time('things.' + operation.name, share)
+
+	# osascript writes UTF-8, and the names in the results are compared with unicode ones.
+	if isinstance(stdout, str):
+		stdout = stdout.decode('utf-8', 'replace')
+	if isinstance(stderr, str):
+		stderr = stderr.decode('utf-8', 'replace')
+	results = parse_results(stdout)
+
+	for index, operation in enumerate(operations):
+		if index in results:
+			(status, value) = results[index]
+			if status == 'ok':
+				operation.finish(value)
+			else:
+				operation.finish(error=value)
+		elif len(stderr) > 0:
+			operation.finish(error=stderr.strip())
+		else:
+			operation.finish(error="No result from osascript")
+
+def submit(operation, batch=None):
+	"""Queue the operation in the batch and return it, or run it now and return its result."""
+
+	if batch is not None:
+		return batch.add(operation)
+
+	run_operations([operation])
+	return operation.result
+
+class Lookups(object):
+	"""The Things ids that have been looked up or created during this run.
+
+	Keys are (project name, to do name), with None as the to do name for the
+	project itself. An id of None means the object is known not to exist. Once
+	every project has been read, projects that weren't found don't exist."""
+
+	def __init__(self):
+		self.ids = {}
+		self.has_every_project = False
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+
+	def get(self, key):
+		"""(True, id) if the key is known, otherwise (False, None). Counts a hit or a miss."""
+
+		self.lock.acquire()
+		try:
+			if key in self.ids:
+				self.hits += 1
+				return (True, self.ids[key])
+			if key[1] is None and self.has_every_project:
+				self.hits += 1
+				return (True, None)
+			self.misses += 1
+			return (False, None)
+		finally:
+			self.lock.release()
+
+	def put(self, key, things_id):
+		self.lock.acquire()
+		self.ids[key] = things_id
+		self.lock.release()
+
+	def forget(self, key):
+		self.lock.acquire()
+		self.ids.pop(key, None)
+		self.lock.release()
+
+	def get_project_name(self, things_id):
+		"""(True, name) if the project with the given id is known, otherwise (False, None).
+		Counts a hit or a miss."""
+
+		self.lock.acquire()
+		try:
+			for (key, known_id) in self.ids.items():
+				if known_id == things_id and key[1] is None:
+					self.hits += 1
+					return (True, key[0])
+			if self.has_every_project:
+				self.hits += 1
+				return (True, None)
+			self.misses += 1
+			return (False, None)
+		finally:
+			self.lock.release()
+
+	def forget_id(self, things_id):
+		"""Forget every name known for the object with the given id."""
+
+		self.lock.acquire()
+		for (key, known_id) in self.ids.items():
+			if known_id == things_id:
+				del self.ids[key]
+		self.lock.release()
+
+	def clear(self):
+		self.lock.acquire()
+		self.ids = {}
+		self.has_every_project = False
+		self.hits = 0
+		self.misses = 0
+		self.lock.release()
+
+	def remember(self, key):
+		"""An Operation callback that stores the id the operation returned for key."""
+
+		def callback(operation):
+			if operation.error is None:
+				self.put(key, operation.result)
+			elif operation.is_missing():
+				self.put(key, None)
+			else:
+				self.forget(key)
+		return callback
+
+lookups = Lookups()
+
+def known(value, batch=None):
+	"""A lookup whose answer is already known, returned the way submit would return it."""
+
+	if batch is None:
+		return value
+	operation = Operation(None)
+	operation.result = value
+	operation.is_done = True
+	return operation
+
+def succeeded(value):
+	return True
+
+def project_named(name):
+	return 'project "%s"' % (quote(name))
+
+def project_with_id(things_id):
+	return 'project id "%s"' % (quote(things_id))
+
+def to_do_named(project_name, name):
+	return 'to do named "%s" of project "%s"' % (quote(name), quote(project_name))
+
+def to_do_with_id(things_id):
+	return 'to do id "%s"' % (quote(things_id))
 
-def get_project_id(name):
+def get_project_id(name, batch=None):
 	"""Get the project's unique identifier from Things, if it exists. None otherwise."""
 
+	(is_known, things_id) = lookups.get((name, None))
+	if is_known:
+		return known(things_id, batch)
+
 	cmd = """
-tell application "Things"
-	set checkProject to project "%s"
-	checkProject
-end tell""" % (name)
-
-	p = subprocess.Popen(['osascript', '-e', cmd], shell=False,
-	 	stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	(stdout, stderr) = p.communicate()
-
-	if len(stderr) > 0:
-		if stderr.find('(-1728)') >= 0:
-			return None
-		else:
-			print "Unhandled error:"
-			print stderr
-			return None
-	else:
-		return stdout.rsplit(' ')[-1]
+set opResult to id of project "%s"
+""" % (quote(name))
 
-def set_project_description(name, description):
-	"""Set the project's Notes property in Things."""
+	return submit(Operation(cmd, missing_ok=True, callback=lookups.remember((name, None)), name='get_project_id'), batch)
+
+def get_project_name(things_id, batch=None):
+	"""Get the name of the project with the given Things id, if it exists. None otherwise."""
+
+	(is_known, name) = lookups.get_project_name(things_id)
+	if is_known:
+		return known(name, batch)
 
 	cmd = """
-tell application "Things"
-	set updateProject to project "%s"
-	set notes of updateProject to "%s"
-end tell""" % (name, description)
-
-	p = subprocess.Popen(['osascript', '-e', cmd], shell=False,
-	 	stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	(stdout, stderr) = p.communicate()
-
-	if len(stderr) > 0:
-		if stderr.find('(-1728)') >= 0:
-			return None
-		else:
-			print "Unhandled error:"
-			print stderr
-			return None
-	else:
-		return stdout.rsplit(' ')[-1]
+set opResult to name of project id "%s"
+""" % (quote(things_id))
+
+	def remember_name(operation):
+		if operation.error is None:
+			lookups.put((operation.result, None), things_id)
 
+	return submit(Operation(cmd, missing_ok=True, callback=remember_name, name='get_project_name'), batch)
 
-def create_project(name, description):
+def rename_project_by_id(things_id, name, new_name, batch=None):
+	"""Rename the project with the given Things id from name to new_name."""
+
+	cmd = """
+set name of project id "%s" to "%s"
+""" % (quote(things_id), quote(new_name))
+
+	def rename(operation):
+		if operation.error is None:
+			lookups.forget((name, None))
+			lookups.put((new_name, None), things_id)
+
+	return submit(Operation(cmd, succeeded, callback=rename, name='rename_project'), batch)
+
+def set_notes(project, description, batch=None):
+	cmd = """
+set notes of %s to "%s"
+""" % (project, quote(description))
+
+	return submit(Operation(cmd, succeeded, missing_ok=True, name='set_project_description'), batch)
+
+def set_project_description(name, description, batch=None):
+	"""Set the project's Notes property in Things."""
+
+	return set_notes(project_named(name), description, batch)
+
+def set_project_description_by_id(things_id, description, batch=None):
+	"""Set the Notes property of the project with the given Things id."""
+
+	return set_notes(project_with_id(things_id), description, batch)
+
+def create_project(name, description, batch=None):
 	"""Create a new Things project with the given name and description.
 	Returns the Things id."""
 
 	cmd = """
-tell application "Things"
-	set newProject to make new project with properties {name:"%s", notes:"%s"}
-	newProject
-end tell""" % (name, description)
+set newProject to make new project with properties {name:"%s", notes:"%s"}
+set opResult to id of newProject
+""" % (quote(name), quote(description))
+
+	return submit(Operation(cmd, callback=lookups.remember((name, None)), name='create_project'), batch)
 
-	p = subprocess.Popen(['osascript', '-e', cmd], shell=False,
-	 	stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	(stdout, stderr) = p.communicate()
+def parse_project_ids(text):
+	"""Parse the result of get_project_ids into a dictionary of project name to id."""
 
-	if len(stderr) > 0:
-		print "Unhandled error:"
-		print "'" + stderr + "'"
-		return None
+	project_ids = {}
+	for record in text.split(TO_DO_SEPARATOR):
+		fields = record.strip('\n').split(PROPERTY_SEPARATOR)
+		if len(fields) != 2:
+			continue
+		project_ids[fields[0]] = fields[1]
+	return project_ids
 
-	return stdout.rsplit(' ')[-1]
+def get_project_ids(batch=None):
+	"""Get a dictionary of every Things project's name to its unique identifier."""
+
+	cmd = """
+set snapshotNames to name of projects
+set snapshotIds to id of projects
+set snapshotRecords to {}
+repeat with i from 1 to count of snapshotIds
+	set end of snapshotRecords to (item i of snapshotNames) & propertySeparator & (item i of snapshotIds)
+end repeat
+set AppleScript's text item delimiters to toDoSeparator
+set opResult to snapshotRecords as text
+set AppleScript's text item delimiters to ""
+"""
+
+	def remember_projects(operation):
+		if operation.result is not None:
+			for (name, things_id) in operation.result.items():
+				lookups.put((name, None), things_id)
+			lookups.has_every_project = True
+
+	return submit(Operation(cmd, parse_project_ids, callback=remember_projects, name='get_project_ids'), batch)
+
+def parse_snapshot(text):
+	"""Parse the result of get_project_snapshot into a dictionary of Things id to ToDo.
+	Several to dos may have the same name, so they're keyed by id.
+
+	text holds one record per to do, separated by TO_DO_SEPARATOR, each of which is
+	name, id, status, tag names and notes separated by PROPERTY_SEPARATOR."""
+
+	snapshot = {}
+	for record in text.split(TO_DO_SEPARATOR):
+		fields = record.strip('\n').split(PROPERTY_SEPARATOR)
+		if len(fields) != 5:
+			continue
+		to_do = ToDo(*fields)
+		snapshot[to_do.things_id] = to_do
+	return snapshot
+
+def get_project_snapshot(project_name, batch=None):
+	"""Get every to do in the project with a single query.
+
+	Returns a dictionary of Things id to ToDo, or None if the project doesn't exist."""
 
-def get_ticket_id(project_name, name):
+	cmd = """
+set snapshotProject to project "%s"
+set snapshotNames to name of to dos of snapshotProject
+set snapshotIds to id of to dos of snapshotProject
+set snapshotStatuses to status of to dos of snapshotProject
+set snapshotTags to tag names of to dos of snapshotProject
+set snapshotNotes to notes of to dos of snapshotProject
+set snapshotRecords to {}
+repeat with i from 1 to count of snapshotIds
+	set end of snapshotRecords to (item i of snapshotNames) & propertySeparator & (item i of snapshotIds) & propertySeparator & ((item i of snapshotStatuses) as text) & propertySeparator & (item i of snapshotTags) & propertySeparator & (item i of snapshotNotes)
+end repeat
+set AppleScript's text item delimiters to toDoSeparator
+set opResult to snapshotRecords as text
+set AppleScript's text item delimiters to ""
+""" % (quote(project_name))
+
+	def remember_to_dos(operation):
+		if operation.is_missing():
+			lookups.put((project_name, None), None)
+		elif operation.result is not None:
+			for to_do in operation.result.values():
+				lookups.put((project_name, to_do.name), to_do.things_id)
+
+	return submit(Operation(cmd, parse_snapshot, missing_ok=True, callback=remember_to_dos, name='get_project_snapshot'), batch)
+
+def get_ticket_id(project_name, name, batch=None):
 	"""Get the ticket's unique identifier from Things, if it exists. None otherwise."""
 
+	(is_known, things_id) = lookups.get((project_name, name))
+	if is_known:
+		return known(things_id, batch)
+
 	cmd = """
-tell application "Things"
-	set ticket to to do named "%s" of project "%s"
-	ticket
-end tell""" % (name, project_name)
-
-	p = subprocess.Popen(['osascript', '-e', cmd], shell=False,
-	 	stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	(stdout, stderr) = p.communicate()
-
-	if len(stderr) > 0:
-		if stderr.find('(-1728)') >= 0:
-			return None
-		else:
-			print "Unhandled error:"
-			print stderr
-			return None
-	else:
-		return stdout.rsplit(' ')[-1]
+set opResult to id of to do named "%s" of project "%s"
+""" % (quote(name), quote(project_name))
+
+	return submit(Operation(cmd, missing_ok=True, callback=lookups.remember((project_name, name)), name='get_ticket_id'), batch)
 
-def create_ticket(project_name, name, description, url):
-	"""Create a new ticket in the given project."""
+def create_ticket(project_name, name, description, url, tags=None, is_completed=False, batch=None):
+	"""Create a new ticket in the given project, with its tags if they're given, and
+	completed if is_completed. Returns the Things id.
+
+	tags is a string of the form: &quot;multi word&quot; singleword anotherword"""
+
+	properties = 'name:"%s", notes:"%s\nLighthouse URL: %s"' % (quote(name), quote(description), quote(url))
+	if tags is not None:
+		properties += ', tag names:"%s"' % (quote(clean_tags(tags)))
 
 	cmd = """
-tell application "Things"
-	set newToDo to make new to do with properties {name:"%s", notes:"%s\nLighthouse URL: %s"} at beginning of project "%s"
-end tell""" % (name, description, url, project_name)
+set newToDo to make new to do with properties {%s} at beginning of project "%s"
+""" % (properties, quote(project_name))
+	if is_completed:
+		cmd += 'set status of newToDo to completed\n'
+	cmd += 'set opResult to id of newToDo\n'
 
-	p = subprocess.Popen(['osascript', '-e', cmd], shell=False,
-	 	stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	(stdout, stderr) = p.communicate()
+	return submit(Operation(cmd, callback=lookups.remember((project_name, name)), name='create_ticket'), batch)
 
-	if len(stderr) > 0:
-		print "Unhandled error:"
-		print "'" + stderr + "'"
-		return None
+def complete(to_do, batch=None):
+	cmd = """
+set status of %s to completed
+""" % (to_do)
 
-	return stdout.rsplit(' ')[-1]
+	return submit(Operation(cmd, succeeded, name='complete_ticket'), batch)
 
-def complete_ticket(project_name, name):
+def complete_ticket(project_name, name, batch=None):
 	"""Mark the given ticket as completed."""
 
+	return complete(to_do_named(project_name, name), batch)
+
+def complete_ticket_by_id(things_id, batch=None):
+	"""Mark the to do with the given Things id as completed."""
+
+	return complete(to_do_with_id(things_id), batch)
+
+def update_script(to_do, new_name=None, notes=None, tags=None):
 	cmd = """
-tell application "Things"
-	set toDoToComplete to to do named "%s" of project "%s"
-	set status of toDoToComplete to completed
-end tell""" % (name, project_name)
-
-	p = subprocess.Popen(['osascript', '-e', cmd], shell=False,
-	 	stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	(stdout, stderr) = p.communicate()
-
-	if len(stderr) > 0:
-		print "Unhandled error:"
-		print "'" + stderr + "'"
-		return None
-	
-	return True
+set updateToDo to %s
+""" % (to_do)
+
+	if new_name is not None:
+		cmd += 'set name of updateToDo to "%s"\n' % (quote(new_name))
+	if notes is not None:
+		cmd += 'set notes of updateToDo to "%s"\n' % (quote(notes))
+	if tags is not None:
+		cmd += 'set tag names of updateToDo to "%s"\n' % (quote(clean_tags(tags)))
+	return cmd
+
+def update_ticket(project_name, name, new_name=None, notes=None, tags=None, batch=None):
+	"""Set the name, notes and/or tags of the given ticket. Properties left as None aren't written.
+
+	tags is a string of the form: &quot;multi word&quot; singleword anotherword"""
+
+	cmd = update_script(to_do_named(project_name, name), new_name, notes, tags)
+
+	def rename(operation):
+		# After a rename, the to do is only known by its new name.
+		if new_name is None or new_name == name:
+			return
+		if operation.error is None:
+			(is_known, things_id) = lookups.get((project_name, name))
+			if is_known and things_id is not None:
+				lookups.put((project_name, new_name), things_id)
+			lookups.forget((project_name, name))
+		elif operation.is_missing():
+			lookups.forget((project_name, name))
+
+	return submit(Operation(cmd, succeeded, callback=rename, name='update_ticket'), batch)
+
+def update_ticket_by_id(things_id, new_name=None, notes=None, tags=None, batch=None):
+	"""Set the name, notes and/or tags of the to do with the given Things id, as update_ticket does."""
+
+	cmd = update_script(to_do_with_id(things_id), new_name, notes, tags)
+
+	def rename(operation):
+		# The to do's old name is no longer known.
+		if new_name is not None and operation.error is None:
+			lookups.forget_id(things_id)
+
+	return submit(Operation(cmd, succeeded, callback=rename, name='update_ticket'), batch)
+
+def clean_tags(tags):
+	"""Convert a Lighthouse tag string to the comma-separated form Things expects.
 
-def set_ticket_tags(project_name, name, tags):
-	"""Set the ticket's tags property.
-	
 	tags is a string of the form: &quot;multi word&quot; singleword anotherword"""
 
 	if tags is None:
@@ -159,7 +743,7 @@ def set_ticket_tags(project_name, name, tags):
 	in_quote = False
 	for tag in taglist:
 		buff += tag.replace('&quot;', '')
-		
+
 		if tag.find('&quot;') == 0:
 			in_quote = True
 		if in_quote and tag.find('&quot;') > 0:
@@ -169,40 +753,39 @@ def set_ticket_tags(project_name, name, tags):
 		elif not in_quote:
 			cleantaglist.append(buff)
 			buff = ""
-	tags = ','.join(cleantaglist)
+	return ','.join(cleantaglist)
+
+def tag_set(tags):
+	"""The set of tags in a comma-separated tag string."""
+
+	if tags is None:
+		return set()
+	return set([tag.strip() for tag in tags.split(',') if len(tag.strip()) > 0])
+
+def set_ticket_tags(project_name, name, tags, batch=None):
+	"""Set the ticket's tags property.
 
+	tags is a string of the form: &quot;multi word&quot; singleword anotherword"""
+
+	return set_tags(to_do_named(project_name, name), tags, batch)
+
+def set_ticket_tags_by_id(things_id, tags, batch=None):
+	"""Set the tags of the to do with the given Things id, as set_ticket_tags does."""
+
+	return set_tags(to_do_with_id(things_id), tags, batch)
+
+def set_tags(to_do, tags, batch=None):
 	cmd = """
-tell application "Things"
-	set toDoToTag to to do named "%s" of project "%s"
-	set tag names of toDoToTag to "%s"
-end tell""" % (name, project_name, tags)
-
-	p = subprocess.Popen(['osascript', '-e', cmd], shell=False,
-	 	stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	(stdout, stderr) = p.communicate()
-
-	if len(stderr) > 0:
-		print "Unhandled error:"
-		print "'" + stderr + "'"
-		return None
-	
-	return True
+set tag names of %s to "%s"
+""" % (to_do, quote(clean_tags(tags)))
+
+	return submit(Operation(cmd, succeeded, name='set_ticket_tags'), batch)
 
-def log_completed_tickets():
+def log_completed_tickets(batch=None):
 	"""Logs all completed tickets in Things."""
 
 	cmd = """
-tell application "Things"
-	log completed now
-end tell"""
-
-	p = subprocess.Popen(['osascript', '-e', cmd], shell=False,
-	 	stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	(stdout, stderr) = p.communicate()
-
-	if len(stderr) > 0:
-		print "Unhandled error:"
-		print "'" + stderr + "'"
-		return None
-	
-	return True
+log completed now
+"""
+
+	return submit(Operation(cmd, succeeded, name='log_completed_tickets'), batch)
@@ -0,0 +1,78 @@
+// A long-lived AppleScript runner for things.WorkerTransport.
+//
+// Run with: osascript -l JavaScript things/worker.js
+//
+// Reads "<length>\n<script>" frames from stdin, runs each script with NSAppleScript and
+// writes "<ok|error> <length>\n<payload>" frames to stdout. Lengths are in bytes. The
+// process exits when stdin is closed.
+
+ObjC.import('Foundation');
+
+var stdin = $.NSFileHandle.fileHandleWithStandardInput;
+var stdout = $.NSFileHandle.fileHandleWithStandardOutput;
+
+function readHeader() {
+	var header = '';
+	while (true) {
+		var data = stdin.readDataOfLength(1);
+		if (data.length == 0) {
+			return null;
+		}
+		var character = $.NSString.alloc.initWithDataEncoding(data, $.NSUTF8StringEncoding).js;
+		if (character == '\n') {
+			return header;
+		}
+		header += character;
+	}
+}
+
+function readScript(length) {
+	var data = $.NSMutableData.data;
+	while (data.length < length) {
+		var chunk = stdin.readDataOfLength(length - data.length);
+		if (chunk.length == 0) {
+			return null;
+		}
+		data.appendData(chunk);
+	}
+	return $.NSString.alloc.initWithDataEncoding(data, $.NSUTF8StringEncoding);
+}
+
+function writeFrame(status, payload) {
+	var data = $(payload).dataUsingEncoding($.NSUTF8StringEncoding);
+	var header = $(status + ' ' + data.length + '\n').dataUsingEncoding($.NSUTF8StringEncoding);
+	stdout.writeData(header);
+	stdout.writeData(data);
+}
+
+function run(source) {
+	var script = $.NSAppleScript.alloc.initWithSource(source);
+	var errorInfo = $();
+	var result = script.executeAndReturnError(errorInfo);
+
+	if (result.isNil()) {
+		// Match osascript's stderr so that callers can look for error numbers such as (-1728).
+		var message = errorInfo.objectForKey('NSAppleScriptErrorMessage').js;
+		var number = errorInfo.objectForKey('NSAppleScriptErrorNumber').js;
+		writeFrame('error', 'execution error: ' + message + ' (' + number + ')\n');
+	} else {
+		var value = result.stringValue;
+		writeFrame('ok', (value.isNil() ? '' : value.js) + '\n');
+	}
+}
+
+function main() {
+	while (true) {
+		var header = readHeader();
+		if (header === null) {
+			return;
+		}
+		var source = readScript(parseInt(header, 10));
+		if (source === null) {
+			return;
+		}
+		run(source);
+	}
+}
+
+main();
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+#
+#  bench_entities.py
+#  Compares parsing ticket bodies full of entity references with sgmllib, which
+#  hands each reference to the soup on its own, and with BeautifulSoup's
+#  XML_TOKENIZER, which hands over each run of text with its references to be
+#  decoded in one step.
+#
+#  Usage:
+#    > python tools/bench_entities.py --tickets 500 --body-size 4000
+#
+#  Every sentence of a body generated by lighthouse_server.py has four references
+#  (&quot;, &amp; and &lt;). Each way of converting entities is timed on the path
+#  the keeper takes, network.RecordReader, and on a whole BeautifulStoneSoup tree.
+#
+#  Copyright 2010 Jeff Verkoeyen. Licensed under the Apache License, Version 2.0.
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+
+from optparse import OptionParser
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import BeautifulSoup
+import network
+import keeper
+import bench_tokenizer
+import lighthouse_server
+
+def read_records(tokenizer, convertEntities):
+	"""The keeper's path. It leaves entities as they are, so convertEntities is always None."""
+
+	reader_class = network.RecordReader
+	if tokenizer is None:
+		reader_class = bench_tokenizer.SGMLRecordReader
+	return lambda xml: list(reader_class('ticket', keeper.Ticket.fields).read(xml))
+
+def build_tree(tokenizer, convertEntities):
+	return lambda xml: BeautifulSoup.BeautifulStoneSoup(xml, tokenizer=tokenizer,
+		convertEntities=convertEntities)
+
+paths = [
+	('records', None, read_records),
+	('tree', None, build_tree),
+	('tree', BeautifulSoup.BeautifulStoneSoup.XML_ENTITIES, build_tree),
+	('tree', BeautifulSoup.BeautifulStoneSoup.HTML_ENTITIES, build_tree),
+]
+
+if __name__ == "__main__":
+	parser = OptionParser()
+	parser.add_option("--body-size", dest="body_size", type="int", default=4000, help="Bytes per ticket body")
+	parser.add_option("--repeat", dest="repeat", type="int", default=3, help="Times to parse each way; the best is kept")
+	parser.add_option("--tickets", dest="tickets", type="int", default=500)
+	parser.add_option("--versions", dest="versions", type="int", default=1, help="Versions per ticket")
+	(args, rest) = parser.parse_args()
+
+	xml = bench_tokenizer.dump(lighthouse_server.Options(projects=1, tickets=args.tickets,
+		body_size=args.body_size, versions=args.versions))
+
+	print "%d tickets, %d bytes, %d references" % (args.tickets, len(xml), xml.count('&'))
+	print "%-10s %-10s %12s %14s %10s" % ('path', 'entities', 'sgmllib (s)', 'tokenizer (s)', 'speedup')
+	for (name, convertEntities, parse) in paths:
+		before = bench_tokenizer.measure(parse(None, convertEntities), xml, args.repeat)
+		after = bench_tokenizer.measure(parse(BeautifulSoup.XML_TOKENIZER, convertEntities), xml, args.repeat)
+		print "%-10s %-10s %12.3f %14.3f %9.1fx" % (name, convertEntities or 'none', before, after,
+			before / max(after, 0.000001))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#
+#  bench_find.py
+#  Compares find and findAll by tag name on a tree of tickets with and without
+#  BeautifulSoup's per-tag name index.
+#
+#  Usage:
+#    > python tools/bench_find.py --tickets 2000
+#
+#  The tree is a synthetic dump (see bench_parse.py) parsed with xml_to_data.
+#  Each lookup runs against a freshly parsed tree, so the time to build the
+#  indexes is included:
+#    root     data.tickets, as keeper.py used to read a page, --repeat times
+#    tickets  data.tickets.findAll('ticket'), --repeat times
+#    fields   every ticket field the keeper reads, with ticket.find(name)
+#
+#  Copyright 2010 Jeff Verkoeyen. Licensed under the Apache License, Version 2.0.
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+
+from optparse import OptionParser
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import network
+import keeper
+import lighthouse_server
+
+def find_root(data, repeat):
+	for i in range(repeat):
+		data.tickets
+
+def find_tickets(data, repeat):
+	for i in range(repeat):
+		data.tickets.findAll('ticket')
+
+def find_fields(data, repeat):
+	for ticket in data.tickets.findAll('ticket'):
+		for name in keeper.Ticket.fields:
+			ticket.find(name)
+
+lookups = [('root', find_root), ('tickets', find_tickets), ('fields', find_fields)]
+
+def dump(options):
+	parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<tickets type="array">\n']
+	for number in range(1, options.tickets + 1):
+		parts.append(lighthouse_server.ticket_xml(options, 1, number))
+	parts.append('</tickets>\n')
+	return ''.join(parts)
+
+def measure(xml, lookup, repeat, use_index):
+	network.StrainedSoup.useNameIndex = use_index
+	data = network.xml_to_data(xml)
+	start = time.time()
+	lookup(data, repeat)
+	return time.time() - start
+
+if __name__ == "__main__":
+	parser = OptionParser()
+	parser.add_option("--tickets", dest="tickets", type="int", default=2000)
+	parser.add_option("--versions", dest="versions", type="int", default=3, help="Versions per ticket")
+	parser.add_option("--repeat", dest="repeat", type="int", default=100, help="Times to repeat each page lookup")
+	(args, rest) = parser.parse_args()
+
+	options = lighthouse_server.Options(projects=1, tickets=args.tickets, versions=args.versions)
+	xml = dump(options)
+
+	print "%d tickets, %d bytes" % (args.tickets, len(xml))
+	print "%-10s %12s %12s %10s" % ('lookup', 'walk (s)', 'index (s)', 'speedup')
+	for (name, lookup) in lookups:
+		walk = measure(xml, lookup, args.repeat, False)
+		index = measure(xml, lookup, args.repeat, True)
+		print "%-10s %12.4f %12.4f %9.1fx" % (name, walk, index, walk / max(index, 0.000001))
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+#
+#  bench_network.py
+#  Compares a new urllib2 connection per page with network.ConnectionPool.
+#
+#  Usage:
+#    > python tools/bench_network.py --pages 200
+#
+#  Both paths fetch the same ticket pages from a local keep-alive stand-in server
+#  (lighthouse_server.py). Prints the number of TCP connections the server accepted
+#  and the total time for each.
+#
+#  Copyright 2010 Jeff Verkoeyen. Licensed under the Apache License, Version 2.0.
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+
+from optparse import OptionParser
+import os
+import sys
+import time
+import urllib2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import network
+import lighthouse_server
+
+def fetch_with_urllib2(urls):
+	for url in urls:
+		urllib2.urlopen(urllib2.Request(url, None, {'X-LighthouseToken': 'test'})).read()
+
+def fetch_with_pool(urls):
+	pool = network.ConnectionPool()
+	for url in urls:
+		pool.request(url, {'X-LighthouseToken': 'test'})
+	pool.close()
+
+def measure(server, fetch, urls):
+	connections = server.connections
+	start = time.time()
+	fetch(urls)
+	return (server.connections - connections, time.time() - start)
+
+if __name__ == "__main__":
+	parser = OptionParser()
+	parser.add_option("--pages", dest="pages", type="int", default=200)
+	(args, rest) = parser.parse_args()
+
+	options = lighthouse_server.Options(projects=1, tickets=args.pages * lighthouse_server.TICKETS_PER_PAGE)
+	server = lighthouse_server.start(options)
+	urls = [server.url() + 'projects/1/tickets.xml?page=%d' % (page) for page in range(1, args.pages + 1)]
+
+	print "%-10s %12s %10s" % ('path', 'connections', 'seconds')
+	for (name, fetch) in [('urllib2', fetch_with_urllib2), ('pool', fetch_with_pool)]:
+		(connections, seconds) = measure(server, fetch, urls)
+		print "%-10s %12d %10.3f" % (name, connections, seconds)
+
+	server.shutdown()
+	server.server_close()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+#
+#  bench_parse.py
+#  Compares parsing a ticket dump into a BeautifulStoneSoup tree, into a tree of
+#  only the fields the keeper reads, and reading it one record at a time with
+#  network.xml_to_records.
+#
+#  Usage:
+#    > python tools/bench_parse.py --tickets 10000
+#
+#  The dump is generated by lighthouse_server.py. Each path runs in a fresh process
+#  so that its peak RSS can be measured, and both end with the same list of
+#  flattened ticket dictionaries that keeper.py keeps for a project.
+#
+#  Copyright 2010 Jeff Verkoeyen. Licensed under the Apache License, Version 2.0.
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+
+from optparse import OptionParser, SUPPRESS_HELP
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import BeautifulSoup
+import network
+import keeper
+import lighthouse_server
+
+def parse_tree(xml, fields=None):
+	"""The path keeper.py used to take: build the tree, then walk every ticket's children."""
+
+	data = network.xml_to_data(xml, fields)
+	tickets = []
+	for ticket_data in data.tickets:
+		if not isinstance(ticket_data, BeautifulSoup.Tag):
+			continue
+		ticket = {}
+		for node in ticket_data.contents:
+			if not isinstance(node, BeautifulSoup.Tag):
+				continue
+			ticket[node.name] = node.string
+		tickets.append(ticket)
+	return tickets
+
+def parse_strained_tree(xml):
+	return parse_tree(xml, keeper.Ticket.fields)
+
+def parse_records(xml):
+	return list(network.xml_to_records(xml, 'ticket', keeper.Ticket.fields))
+
+paths = [('tree', parse_tree), ('strained', parse_strained_tree), ('records', parse_records)]
+
+def peak_rss_kb():
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == 'darwin':
+		# Bytes on Mac OS X, kilobytes everywhere else.
+		peak /= 1024
+	return peak
+
+def write_dump(path, options):
+	f = open(path, 'w')
+	f.write('<?xml version="1.0" encoding="UTF-8"?>\n<tickets type="array">\n')
+	for number in range(1, options.tickets + 1):
+		f.write(lighthouse_server.ticket_xml(options, 1, number))
+	f.write('</tickets>\n')
+	f.close()
+
+def run_path(name, dump_path):
+	"""Parse the dump with one path and print: tickets seconds base_rss_kb peak_rss_kb."""
+
+	f = open(dump_path, 'r')
+	xml = f.read()
+	f.close()
+
+	base = peak_rss_kb()
+	start = time.time()
+	tickets = dict(paths)[name](xml)
+	seconds = time.time() - start
+	print len(tickets), seconds, base, peak_rss_kb()
+
+if __name__ == "__main__":
+	parser = OptionParser()
+	parser.add_option("--tickets", dest="tickets", type="int", default=10000)
+	parser.add_option("--body-size", dest="body_size", type="int", default=200, help="Bytes per ticket body")
+	parser.add_option("--versions", dest="versions", type="int", default=3, help="Versions per ticket")
+	parser.add_option("--path", dest="path", help=SUPPRESS_HELP)
+	parser.add_option("--dump", dest="dump", help=SUPPRESS_HELP)
+	(args, rest) = parser.parse_args()
+
+	if args.path is not None:
+		run_path(args.path, args.dump)
+		sys.exit(0)
+
+	options = lighthouse_server.Options(projects=1, tickets=args.tickets,
+		body_size=args.body_size, versions=args.versions)
+	(handle, dump_path) = tempfile.mkstemp(suffix='.xml')
+	os.close(handle)
+	try:
+		write_dump(dump_path, options)
+		print "%d tickets, %d bytes" % (args.tickets, os.path.getsize(dump_path))
+		print "%-10s %10s %14s" % ('path', 'seconds', 'peak RSS (MB)')
+		for (name, parse) in paths:
+			output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+				'--path', name, '--dump', dump_path])
+			(count, seconds, base, peak) = output.split()
+			print "%-10s %10.3f %14.1f" % (name, float(seconds), (int(peak) - int(base)) / 1024.0)
+	finally:
+		os.remove(dump_path)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#
+#  bench_records.py
+#  Compares the memory held by tickets kept as dictionaries with keeper.Ticket records.
+#
+#  Usage:
+#    > python tools/bench_records.py --tickets 10000 --body-size 2000
+#
+#  Both read the same synthetic dump (see bench_parse.py) one ticket at a time and
+#  keep every ticket, as a sync does. Each runs in a fresh process and reports the
+#  bytes of every object the kept tickets hold on to, and how much its peak RSS
+#  grew while reading.
+#
+#  Copyright 2010 Jeff Verkoeyen. Licensed under the Apache License, Version 2.0.
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+
+from optparse import OptionParser, SUPPRESS_HELP
+import gc
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import network
+import keeper
+import bench_parse
+import lighthouse_server
+
+class DictTicket(dict):
+	"""A ticket as keeper.py used to keep it."""
+
+	def __init__(self, ticket_data, project_name, config):
+		self.project_name = project_name
+		self.config = config
+		self.things_id = None
+		self.update(ticket_data)
+
+def keep_dicts(xml):
+	project_name = u'Project 1 (LH)'
+	return [DictTicket(data, project_name, None)
+		for data in network.xml_to_records(xml, 'ticket', keeper.Ticket.fields)]
+
+def keep_records(xml):
+	return [keeper.Ticket(data) for data in network.xml_to_records(xml, 'ticket', keeper.Ticket.fields)]
+
+paths = [('dict', keep_dicts), ('record', keep_records)]
+
+def retained_bytes(objects):
+	"""The size of the objects and of everything they refer to, each counted once."""
+
+	seen = set()
+	total = 0
+	while len(objects) > 0:
+		obj = objects.pop()
+		if id(obj) in seen or isinstance(obj, type):
+			continue
+		seen.add(id(obj))
+		total += sys.getsizeof(obj)
+		objects.extend(gc.get_referents(obj))
+	return total
+
+def run_path(name, dump_path):
+	"""Read the dump with one path and print: tickets retained_bytes base_rss_kb peak_rss_kb."""
+
+	f = open(dump_path, 'r')
+	xml = f.read()
+	f.close()
+
+	base = bench_parse.peak_rss_kb()
+	tickets = dict(paths)[name](xml)
+	peak = bench_parse.peak_rss_kb()
+	print len(tickets), retained_bytes(list(tickets)), base, peak
+
+if __name__ == "__main__":
+	parser = OptionParser()
+	parser.add_option("--tickets", dest="tickets", type="int", default=10000)
+	parser.add_option("--body-size", dest="body_size", type="int", default=200, help="Bytes per ticket body")
+	parser.add_option("--path", dest="path", help=SUPPRESS_HELP)
+	parser.add_option("--dump", dest="dump", help=SUPPRESS_HELP)
+	(args, rest) = parser.parse_args()
+
+	if args.path is not None:
+		run_path(args.path, args.dump)
+		sys.exit(0)
+
+	options = lighthouse_server.Options(projects=1, tickets=args.tickets,
+		body_size=args.body_size, versions=0)
+	(handle, dump_path) = tempfile.mkstemp(suffix='.xml')
+	os.close(handle)
+	try:
+		bench_parse.write_dump(dump_path, options)
+		print "%d tickets, %d bytes" % (args.tickets, os.path.getsize(dump_path))
+		print "%-10s %14s %16s %14s" % ('path', 'retained (MB)', 'bytes per ticket', 'peak RSS (MB)')
+		for (name, keep) in paths:
+			output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+				'--path', name, '--dump', dump_path])
+			(count, retained, base, peak) = [int(value) for value in output.split()]
+			print "%-10s %14.1f %16d %14.1f" % (name, retained / 1048576.0, retained / max(1, count),
+				(peak - base) / 1024.0)
+	finally:
+		os.remove(dump_path)
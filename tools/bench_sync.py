@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+#
+#  bench_sync.py
+#  Runs whole syncs with Lighthouse.update_projects against a local Lighthouse
+#  stand-in and an in-memory fake Things, and reports their throughput.
+#
+#  Usage:
+#    > python tools/bench_sync.py --projects 5 --tickets 1000
+#    > python tools/bench_sync.py --scenario initial --script-latency 0.2 --delay 0.05
+#
+#  Scenarios:
+#    initial    The first sync of an account into an empty Things.
+#    unchanged  A second sync right after the first; nothing has changed.
+#    edited     Every ticket's body has changed since the first sync.
+#    rebuild    The sync state is rebuilt, so every ticket is compared with Things.
+#
+#  The account is served by lighthouse_server.py, with --delay seconds per response.
+#  Things is a fakethings.FakeTransport, with --script-latency seconds per script and
+#  --operation-latency seconds per operation. Each sync runs in a fresh process so
+#  that its peak RSS can be measured; the syncs a scenario starts from run in
+#  processes of their own. Prints tickets per second, peak RSS, and the number of
+#  page requests, Things scripts and Things operations of each scenario.
+#
+#  Copyright 2010 Jeff Verkoeyen. Licensed under the Apache License, Version 2.0.
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+
+from optparse import OptionParser, SUPPRESS_HELP, Values
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import network
+import cache
+import fetch
+import keeper
+import metrics
+import state
+import things
+import bench_parse
+import fakethings
+import lighthouse_server
+
+# The syncs each scenario starts from, then the arguments of the sync that's measured.
+scenarios = [
+	('initial', [], []),
+	('unchanged', [[]], []),
+	('edited', [[]], ['--full']),
+	('rebuild', [[]], ['--full', '--rebuild-state']),
+]
+
+def run_sync(args):
+	"""Run one sync in this process and print its measurements as JSON."""
+
+	network.cache = cache.Cache(os.path.join(args.work_dir, 'cache'), keeper.Lighthouse.cache_expiration_seconds)
+	network.pool = network.ConnectionPool()
+
+	things_path = os.path.join(args.work_dir, 'things.json')
+	fake = fakethings.load(things_path)
+	transport = fakethings.FakeTransport(fake, args.script_latency, args.operation_latency)
+	things.set_transport(transport)
+
+	sync_state = state.SyncState(os.path.join(args.work_dir, 'state.sqlite'))
+	if args.rebuild_state:
+		sync_state.rebuild()
+
+	config = keeper.Config(Values({
+		'account': 'test',
+		'base_url': args.url,
+		'batch_size': args.batch_size,
+		'compress_cache': False,
+		'concurrency': args.concurrency,
+		'config': None,
+		'is_dry_run': False,
+		'is_full_sync': args.is_full_sync,
+		'is_verbose': False,
+		'token': 'test',
+	}))
+
+	base = bench_parse.peak_rss_kb()
+	start = time.time()
+	keeper.Lighthouse(config, sync_state).update_projects()
+	things.log_completed_tickets()
+	seconds = time.time() - start
+	peak = bench_parse.peak_rss_kb()
+
+	things.transport.close()
+	network.pool.close()
+	network.cache.close()
+	sync_state.close()
+	fakethings.save(fake, things_path)
+
+	timings = metrics.registry.timings
+	print json.dumps({
+		'tickets': timings['records.ticket'].count if 'records.ticket' in timings else 0,
+		'seconds': seconds,
+		'base_rss_kb': base,
+		'peak_rss_kb': peak,
+		'requests': timings['http.request'].count if 'http.request' in timings else 0,
+		'scripts': transport.scripts,
+		'operations': transport.operations,
+		'calls': fake.calls,
+	})
+
+def sync_in_process(args, work_dir, url, sync_args):
+	command = [sys.executable, os.path.abspath(__file__), '--run', '--work-dir', work_dir, '--url', url,
+		'--batch-size', str(args.batch_size), '--concurrency', str(args.concurrency),
+		'--script-latency', str(args.script_latency), '--operation-latency', str(args.operation_latency)]
+	output = subprocess.check_output(command + sync_args)
+	return json.loads(output.strip().split('\n')[-1])
+
+def run_scenario(args, name, setup, sync_args):
+	options = lighthouse_server.Options(args.projects, args.tickets, args.body_size, args.tags,
+		args.versions, args.delay)
+	server = lighthouse_server.start(options)
+	work_dir = tempfile.mkdtemp()
+	try:
+		for setup_args in setup:
+			sync_in_process(args, work_dir, server.url(), setup_args)
+		if name == 'edited':
+			# Bodies are whole repeats of a sentence, so doubling the size changes every one.
+			# Every page is different now, so none can come from the cache.
+			options.body_size *= 2
+			shutil.rmtree(os.path.join(work_dir, 'cache'))
+		return sync_in_process(args, work_dir, server.url(), sync_args)
+	finally:
+		server.shutdown()
+		server.server_close()
+		shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+	parser = OptionParser()
+	parser.add_option("-b", "--batch-size", dest="batch_size", type="int", default=things.DEFAULT_BATCH_SIZE)
+	parser.add_option("--body-size", dest="body_size", type="int", default=200, help="Bytes per ticket body")
+	parser.add_option("-j", "--concurrency", dest="concurrency", type="int", default=fetch.DEFAULT_CONCURRENCY)
+	parser.add_option("--delay", dest="delay", type="float", default=0.0,
+						help="Seconds the Lighthouse stand-in waits before each response")
+	parser.add_option("-f", "--full", dest="is_full_sync", action="store_true", help=SUPPRESS_HELP)
+	parser.add_option("--operation-latency", dest="operation_latency", type="float", default=0.0,
+						help="Seconds fake Things takes for each operation")
+	parser.add_option("--projects", dest="projects", type="int", default=3)
+	parser.add_option("--rebuild-state", dest="rebuild_state", action="store_true", help=SUPPRESS_HELP)
+	parser.add_option("--report", dest="report", help="Write the measurements of every scenario to this JSON file")
+	parser.add_option("--run", dest="run", action="store_true", help=SUPPRESS_HELP)
+	parser.add_option("--scenario", dest="scenarios", action="append",
+						help="Run only this scenario (may be given more than once)")
+	parser.add_option("--script-latency", dest="script_latency", type="float", default=0.0,
+						help="Seconds fake Things takes for each script")
+	parser.add_option("--tags", dest="tags", type="int", default=3, help="Tags per ticket")
+	parser.add_option("--tickets", dest="tickets", type="int", default=1000, help="Tickets per project")
+	parser.add_option("--url", dest="url", help=SUPPRESS_HELP)
+	parser.add_option("--versions", dest="versions", type="int", default=3, help="Versions per ticket")
+	parser.add_option("--work-dir", dest="work_dir", help=SUPPRESS_HELP)
+	(args, rest) = parser.parse_args()
+
+	if args.run:
+		run_sync(args)
+		sys.exit(0)
+
+	print "%d projects of %d tickets, %d byte bodies, %d tags" % (args.projects, args.tickets,
+		args.body_size, args.tags)
+	print "%-10s %8s %9s %10s %14s %9s %8s %11s" % ('scenario', 'tickets', 'seconds', 'tickets/s',
+		'peak RSS (MB)', 'requests', 'scripts', 'operations')
+	results = {}
+	for (name, setup, sync_args) in scenarios:
+		if args.scenarios is not None and name not in args.scenarios:
+			continue
+		result = results[name] = run_scenario(args, name, setup, sync_args)
+		print "%-10s %8d %9.3f %10.1f %14.1f %9d %8d %11d" % (name, result['tickets'], result['seconds'],
+			result['tickets'] / max(result['seconds'], 0.001), result['peak_rss_kb'] / 1024.0,
+			result['requests'], result['scripts'], result['operations'])
+
+	if args.report is not None:
+		f = open(args.report, 'w')
+		json.dump(results, f, indent=1, sort_keys=True)
+		f.close()
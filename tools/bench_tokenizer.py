@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+#
+#  bench_tokenizer.py
+#  Checks that BeautifulSoup's XML_TOKENIZER builds the same trees as sgmllib,
+#  then compares how long each takes to parse a ticket dump.
+#
+#  Usage:
+#    > python tools/bench_tokenizer.py --tickets 2000
+#    > python tools/bench_tokenizer.py --check
+#
+#  The check parses a corpus of documents, from well-formed Lighthouse pages to
+#  markup the tokenizer has to leave to sgmllib, with and without the tokenizer:
+#  as BeautifulStoneSoup and BeautifulSoup trees, as strict BeautifulStoneSoup and
+#  network.StrainedSoup trees, and with network.RecordReader in chunks of several
+#  sizes. Every tree, record and UnbalancedTagError has to be identical. The
+#  benchmark parses a dump generated by lighthouse_server.py each way.
+#
+#  Copyright 2010 Jeff Verkoeyen. Licensed under the Apache License, Version 2.0.
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+
+from optparse import OptionParser
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import BeautifulSoup
+import network
+import keeper
+import lighthouse_server
+
+class SGMLStrainedSoup(network.StrainedSoup):
+	tokenizer = None
+
+class SGMLRecordReader(network.RecordReader):
+	tokenizer = None
+
+corpus = [
+	('empty', ''),
+	('text', 'just text & more'),
+	('declaration', '<?xml version="1.0" encoding="UTF-8"?>\n<a>1</a>\n'),
+	('nested', '<a><b><c>1</c><c>2</c></b><d/></a>'),
+	('self-closing', '<a><x/><y /><z>3</z></a>'),
+	('attributes', '<a type="integer" nil="true" Quote=\'it "is"\'>1</a>'),
+	('attribute entities', '<a title="&quot;x&quot; &amp; &#65; &unknown; &lt;">1</a>'),
+	('unquoted attribute', '<a type=integer b>1</a><c d="1">2</c>'),
+	('bracket in attribute', '<a title="1 > 0">1</a><b title="<">2</b>'),
+	('uppercase', '<A B="C"><D>text</D></a>'),
+	('namespaces', '<a:b c:d="1"><e>2</e></a:b>'),
+	('entities', '<a>&amp;&lt;&gt;&quot;&apos;&nbsp;&copy;&#65;&#8212;&#x41;&bogus;</a>'),
+	('bare ampersands', '<a>AT&T & co &amp no semicolon &#65 &# &#x &a-b- &&; &</a>'),
+	('entity runs', '<a>&quot;fix &amp; ship&quot; when 1 &lt; 2 &apos;&copy;&eacute;&#233;&#8364;&carol;'
+		'&a.b; &x-y;</a><b>&amp;</b><c>&amp</c>&amp;'),
+	('comments', '<a><!-- one --><!-- two -- ><!----><b>1</b><!-- <c> --></a>'),
+	('processing instructions', '<?xml version="1.0"?><?pi data?><a><?x?></a>'),
+	('cdata', '<a><![CDATA[<b>not a tag</b> & stuff]]></a>'),
+	('doctype', '<!DOCTYPE a SYSTEM "a.dtd"><a>1</a>'),
+	('shorttag', '<a><b/data/<c>1</c></a>'),
+	('unbalanced', '<a><b>1</a><c>2</b></c></d>'),
+	('stray end tags', '</a><a></b>1</a>'),
+	('whitespace in tags', '<a  b = "1"  >1</a ><c\n>2</c\n>'),
+	('truncated', '<a><b>1</b><c type="int'),
+	('truncated entity', '<a>1 &am'),
+	('unicode', u'<a title="caf\xe9">\u2603 snowman</a>'),
+	('html', '<html><head><meta http-equiv="Content-Type" content="text/html; charset=utf-8">'
+		'<script>if (a < b && c) {}</script></head><body><p>1<p>2<br>3</body></html>'),
+	('lighthouse', None),
+]
+
+def lighthouse_page():
+	options = lighthouse_server.Options(projects=1, tickets=20, versions=2)
+	return dump(options)
+
+def dump(options):
+	parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<tickets type="array">\n']
+	for number in range(1, options.tickets + 1):
+		parts.append(lighthouse_server.ticket_xml(options, 1, number))
+	parts.append('</tickets>\n')
+	return ''.join(parts)
+
+def describe(node):
+	"""Everything about a tree that the tokenizer could change, as nested lists."""
+
+	if isinstance(node, BeautifulSoup.Tag):
+		return [node.name, node.attrs, node.isSelfClosing, [describe(child) for child in node.contents]]
+	return [node.__class__.__name__, unicode(node)]
+
+def parsed(parse):
+	"""What parse() returns, or the error it raises when the markup is parsed strictly."""
+
+	try:
+		return parse()
+	except BeautifulSoup.UnbalancedTagError, e:
+		return ['UnbalancedTagError', str(e)]
+
+def trees(markup, tokenizer):
+	"""The trees and records markup parses into with tokenizer, one for each way it's parsed."""
+
+	results = []
+	results.append(describe(BeautifulSoup.BeautifulStoneSoup(markup, tokenizer=tokenizer)))
+	for convertEntities in [BeautifulSoup.BeautifulStoneSoup.XML_ENTITIES,
+			BeautifulSoup.BeautifulStoneSoup.HTML_ENTITIES, BeautifulSoup.BeautifulStoneSoup.XHTML_ENTITIES]:
+		results.append(describe(BeautifulSoup.BeautifulStoneSoup(markup, tokenizer=tokenizer,
+			convertEntities=convertEntities)))
+	results.append(describe(BeautifulSoup.BeautifulSoup(markup, tokenizer=tokenizer)))
+	results.append(parsed(lambda: describe(BeautifulSoup.BeautifulStoneSoup(markup, tokenizer=tokenizer,
+		strict=True))))
+	if tokenizer is None:
+		(strained_soup, record_reader) = (SGMLStrainedSoup, SGMLRecordReader)
+	else:
+		(strained_soup, record_reader) = (network.StrainedSoup, network.RecordReader)
+	results.append(parsed(lambda: describe(strained_soup(markup))))
+	results.append(parsed(lambda: describe(strained_soup(markup, keeper.Ticket.fields))))
+	for chunk_size in [1, 7, 64, network.READ_CHUNK_SIZE]:
+		results.append(parsed(lambda: list(record_reader('ticket', keeper.Ticket.fields).read(markup,
+			chunk_size))))
+	return results
+
+def check():
+	"""Compare the trees of every document in the corpus. Returns the number that differ."""
+
+	failures = 0
+	for (name, markup) in corpus:
+		if markup is None:
+			markup = lighthouse_page()
+		expected = trees(markup, None)
+		actual = trees(markup, BeautifulSoup.XML_TOKENIZER)
+		for (index, (a, b)) in enumerate(zip(expected, actual)):
+			if a != b:
+				print "MISMATCH %s (parse %d)\n  sgmllib:   %r\n  tokenizer: %r" % (name, index, a, b)
+				failures += 1
+	print "%d documents, %d mismatches" % (len(corpus), failures)
+	return failures
+
+def measure(parse, xml, repeat):
+	best = None
+	for i in range(repeat):
+		start = time.time()
+		parse(xml)
+		seconds = time.time() - start
+		if best is None or seconds < best:
+			best = seconds
+	return best
+
+paths = [
+	('tree', lambda xml: BeautifulSoup.BeautifulStoneSoup(xml),
+		lambda xml: BeautifulSoup.BeautifulStoneSoup(xml, tokenizer=BeautifulSoup.XML_TOKENIZER)),
+	('strained', lambda xml: SGMLStrainedSoup(xml, keeper.Ticket.fields),
+		lambda xml: network.StrainedSoup(xml, keeper.Ticket.fields)),
+	('records', lambda xml: list(SGMLRecordReader('ticket', keeper.Ticket.fields).read(xml)),
+		lambda xml: list(network.RecordReader('ticket', keeper.Ticket.fields).read(xml))),
+]
+
+if __name__ == "__main__":
+	parser = OptionParser()
+	parser.add_option("--check", dest="check_only", action="store_true", help="Only check the corpus")
+	parser.add_option("--repeat", dest="repeat", type="int", default=3, help="Times to parse each way; the best is kept")
+	parser.add_option("--tickets", dest="tickets", type="int", default=2000)
+	parser.add_option("--versions", dest="versions", type="int", default=3, help="Versions per ticket")
+	(args, rest) = parser.parse_args()
+
+	if check() > 0:
+		sys.exit(1)
+	if args.check_only:
+		sys.exit(0)
+
+	xml = dump(lighthouse_server.Options(projects=1, tickets=args.tickets, versions=args.versions))
+	print
+	print "%d tickets, %d bytes" % (args.tickets, len(xml))
+	print "%-10s %12s %14s %10s" % ('path', 'sgmllib (s)', 'tokenizer (s)', 'speedup')
+	for (name, sgml, tokenized) in paths:
+		before = measure(sgml, xml, args.repeat)
+		after = measure(tokenized, xml, args.repeat)
+		print "%-10s %12.3f %14.3f %9.1fx" % (name, before, after, before / max(after, 0.000001))
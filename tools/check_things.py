@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+#
+#  check_things.py
+#  Checks things.py's parsers against osascript output saved in fixtures/,
+#  without Things.
+#
+#  Usage:
+#    > python tools/check_things.py
+#
+#  fixtures/osascript_batch.txt is the stdout of one batch, as the bytes osascript
+#  writes: every Things project, the snapshot of a project whose to dos include
+#  two with the same name, lookups of a project and a to do that don't exist, and
+#  a to do being completed. Names, tags and notes have non-ASCII characters, and
+#  Things's own error messages use a curly apostrophe. The batch is replayed
+#  through things.run_operations, and every operation's result has to be the
+#  expected one.
+#
+#  Copyright 2010 Jeff Verkoeyen. Licensed under the Apache License, Version 2.0.
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import things
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'osascript_batch.txt')
+
+class ReplayTransport(object):
+	"""A things.py transport that answers every script with the same saved stdout."""
+
+	def __init__(self, stdout):
+		self.stdout = stdout
+		self.scripts = []
+
+	def run(self, cmd):
+		self.scripts.append(cmd)
+		return (self.stdout, '')
+
+	def close(self):
+		pass
+
+def describe(result):
+	"""The result of an operation, with any ToDo as a tuple of its fields."""
+
+	if isinstance(result, dict):
+		described = {}
+		for (key, value) in result.items():
+			described[key] = describe(value)
+		return described
+	if isinstance(result, things.ToDo):
+		return (result.name, result.things_id, result.status, result.tags, result.notes)
+	return result
+
+project = u'Caf\xe9 (LH)'
+url = u'\nLighthouse URL: http://example.lighthouseapp.com/projects/1/tickets/'
+
+# (operation name, queue the operation in a batch, its expected result, whether it's missing)
+operations = [
+	('get_project_ids', lambda batch: things.get_project_ids(batch), {
+		project: u'8F1B2C3D-4E5F-4A6B-9C7D-0E1F2A3B4C5D',
+		u'Inbox tasks (LH)': u'1A2B3C4D-5E6F-4071-8293-A4B5C6D7E8F9',
+		u'Errands': u'0F9E8D7C-6B5A-4938-8271-605F4E3D2C1B',
+	}, False),
+	('get_project_snapshot', lambda batch: things.get_project_snapshot(project, batch), {
+		u'C0FFEE00-1111-4222-8333-444455556666': (u'Fix the cr\xe8me br\xfbl\xe9e (Lighthouse number: 7)',
+			u'C0FFEE00-1111-4222-8333-444455556666', u'open', u'bug, ui', u'It\u2019s burnt.' + url + u'7'),
+		u'C0FFEE00-2222-4333-8444-555566667777': (u'Ship it (Lighthouse number: 12)',
+			u'C0FFEE00-2222-4333-8444-555566667777', u'completed', u'', url + u'12'),
+		u'C0FFEE00-3333-4444-8555-666677778888': (u'Ship it (Lighthouse number: 12)',
+			u'C0FFEE00-3333-4444-8555-666677778888', u'open', u'release', u'A copy made by hand.'),
+		u'C0FFEE00-4444-4555-8666-777788889999': (u'Call the \u2603 shop',
+			u'C0FFEE00-4444-4555-8666-777788889999', u'open', u'', u''),
+	}, False),
+	('get_project_id', lambda batch: things.get_project_id(u'Gone (LH)', batch), None, True),
+	('get_ticket_id', lambda batch: things.get_ticket_id(project, u'Nope', batch), None, True),
+	('complete_ticket', lambda batch: things.complete_ticket_by_id(u'C0FFEE00-4444-4555-8666-777788889999', batch),
+		True, False),
+]
+
+def check():
+	"""Replay the fixture and compare every result. Returns the number that differ."""
+
+	f = open(FIXTURE_PATH, 'rb')
+	stdout = f.read()
+	f.close()
+
+	things.lookups.clear()
+	transport = ReplayTransport(stdout)
+	things.set_transport(transport)
+
+	batch = things.Batch(len(operations))
+	queued = [queue(batch) for (name, queue, expected, is_missing) in operations]
+	batch.flush()
+
+	failures = 0
+	if len(transport.scripts) != 1:
+		print "MISMATCH the operations ran in %d scripts instead of one" % (len(transport.scripts))
+		failures += 1
+	for ((name, queue, expected, is_missing), operation) in zip(operations, queued):
+		actual = describe(operation.result)
+		if actual != expected or operation.is_missing() != is_missing:
+			print "MISMATCH %s\n  expected: %r (missing: %s)\n  actual:   %r (error: %r)" % (name,
+				expected, is_missing, actual, operation.error)
+			failures += 1
+	print "%d operations, %d mismatches" % (len(operations), failures)
+	return failures
+
+if __name__ == "__main__":
+	if check() > 0:
+		sys.exit(1)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+#
+#  fake_worker.py
+#  A stand-in for things/worker.js that runs scripts against fakethings.py.
+#
+#  Usage:
+#    > python keeper.py --worker-command "python tools/fake_worker.py" ...
+#
+#  Speaks the same framing protocol as the real worker. The fake Things state is
+#  loaded from FAKE_THINGS_STATE (if set) on start and saved back when stdin closes.
+#
+#  Copyright 2010 Jeff Verkoeyen. Licensed under the Apache License, Version 2.0.
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fakethings
+
+def write_frame(status, payload):
+	payload = payload.encode('utf-8')
+	sys.stdout.write('%s %d\n' % (status, len(payload)))
+	sys.stdout.write(payload)
+	sys.stdout.flush()
+
+if __name__ == "__main__":
+	state_path = os.environ.get('FAKE_THINGS_STATE')
+	fake = fakethings.load(state_path)
+
+	while True:
+		header = sys.stdin.readline()
+		if len(header) == 0:
+			break
+		script = sys.stdin.read(int(header)).decode('utf-8')
+
+		(stdout, stderr) = fake.run(script)
+		if len(stderr) > 0:
+			write_frame('error', stderr)
+		else:
+			write_frame('ok', stdout)
+
+	fakethings.save(fake, state_path)
@@ -0,0 +1,253 @@
+#
+#  fakethings.py
+#  A stand-in for Things that understands the scripts generated by things.py.
+#
+#  Used by the stub osascript in this directory so that the keeper can be run
+#  on machines without Things (or without a Mac). FakeTransport runs scripts
+#  against it in the same process, with a configurable latency, for benchmarks.
+#
+#  Copyright 2010 Jeff Verkoeyen. Licensed under the Apache License, Version 2.0.
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import things
+
+STRING = r'"((?:[^"\\]|\\.)*)"'
+
+def unquote(text):
+	if text is None:
+		return None
+	return re.sub(r'\\(.)', r'\1', text)
+
+class FakeError(Exception):
+	def __init__(self, number, message):
+		Exception.__init__(self, message)
+		self.number = number
+		self.message = message
+
+class FakeThings(object):
+	"""An in-memory model of the Things projects and to dos the keeper touches."""
+
+	def __init__(self, state=None):
+		if state is None:
+			state = {'next_id': 1, 'projects': {}, 'logged': 0}
+		self.state = state
+		# The number of times each command has run, by name.
+		self.calls = {}
+		self.commands = [
+			(r'set opResult to id of project %s$' % STRING, self.get_project_id),
+			(r'set opResult to name of project id %s$' % STRING, self.get_project_name),
+			(r'set name of project id %s to %s$' % (STRING, STRING), self.rename_project_by_id),
+			(r'set notes of project %s to %s$' % (STRING, STRING), self.set_project_notes),
+			(r'set notes of project id %s to %s$' % (STRING, STRING), self.set_project_notes_by_id),
+			(r'set newProject to make new project with properties \{name:%s, notes:%s\}\s*set opResult to id of newProject$' % (STRING, STRING), self.create_project),
+			(r'set snapshotNames to name of projects\n.*$', self.get_project_ids),
+			(r'set snapshotProject to project %s\n.*$' % STRING, self.get_project_snapshot),
+			(r'set opResult to id of to do named %s of project %s$' % (STRING, STRING), self.get_to_do_id),
+			(r'set newToDo to make new to do with properties \{name:%s, notes:%s(?:, tag names:%s)?\} at beginning of project %s\s*(?:set status of newToDo to (completed)\s*)?set opResult to id of newToDo$' % (STRING, STRING, STRING, STRING), self.create_to_do),
+			(r'set updateToDo to to do named %s of project %s\n.*$' % (STRING, STRING), self.update_to_do),
+			(r'set updateToDo to to do id %s\n.*$' % STRING, self.update_to_do_by_id),
+			(r'set status of to do named %s of project %s to completed$' % (STRING, STRING), self.complete_to_do),
+			(r'set status of to do id %s to completed$' % STRING, self.complete_to_do_by_id),
+			(r'set tag names of to do named %s of project %s to %s$' % (STRING, STRING, STRING), self.set_to_do_tags),
+			(r'set tag names of to do id %s to %s$' % (STRING, STRING), self.set_to_do_tags_by_id),
+			(r'log completed now$', self.log_completed),
+		]
+
+	def new_id(self):
+		things_id = 'fake-%d' % self.state['next_id']
+		self.state['next_id'] += 1
+		return things_id
+
+	def project(self, name):
+		if name not in self.state['projects']:
+			raise FakeError(-1728, 'Can\'t get project "%s".' % name)
+		return self.state['projects'][name]
+
+	def to_do(self, project_name, name):
+		project = self.project(project_name)
+		for to_do in project['to_dos']:
+			if to_do['name'] == name:
+				return to_do
+		raise FakeError(-1728, 'Can\'t get to do "%s" of project "%s".' % (name, project_name))
+
+	def project_with_id(self, things_id):
+		for project in self.state['projects'].values():
+			if project['id'] == things_id:
+				return project
+		raise FakeError(-1728, 'Can\'t get project id "%s".' % things_id)
+
+	def to_do_with_id(self, things_id):
+		for project in self.state['projects'].values():
+			for to_do in project['to_dos']:
+				if to_do['id'] == things_id:
+					return to_do
+		raise FakeError(-1728, 'Can\'t get to do id "%s".' % things_id)
+
+	def get_project_id(self, name):
+		return self.project(name)['id']
+
+	def get_project_name(self, things_id):
+		return self.project_with_id(things_id)['name']
+
+	def rename_project_by_id(self, things_id, name):
+		project = self.project_with_id(things_id)
+		del self.state['projects'][project['name']]
+		project['name'] = name
+		self.state['projects'][name] = project
+		return ''
+
+	def set_project_notes(self, name, notes):
+		self.project(name)['notes'] = notes
+		return ''
+
+	def set_project_notes_by_id(self, things_id, notes):
+		self.project_with_id(things_id)['notes'] = notes
+		return ''
+
+	def create_project(self, name, notes):
+		project = {'id': self.new_id(), 'name': name, 'notes': notes, 'to_dos': []}
+		self.state['projects'][name] = project
+		return project['id']
+
+	def get_project_ids(self):
+		records = []
+		for project in self.state['projects'].values():
+			records.append(things.PROPERTY_SEPARATOR.join([project['name'], project['id']]))
+		return things.TO_DO_SEPARATOR.join(records)
+
+	def get_project_snapshot(self, project_name):
+		records = []
+		for to_do in self.project(project_name)['to_dos']:
+			# Things reports tag names separated by a comma and a space.
+			tags = ', '.join([tag for tag in to_do['tags'].split(',') if len(tag) > 0])
+			fields = [to_do['name'], to_do['id'], to_do['status'], tags, to_do['notes']]
+			records.append(things.PROPERTY_SEPARATOR.join(fields))
+		return things.TO_DO_SEPARATOR.join(records)
+
+	def get_to_do_id(self, name, project_name):
+		return self.to_do(project_name, name)['id']
+
+	def create_to_do(self, name, notes, tags, project_name, status):
+		if tags is None:
+			tags = ''
+		if status is None:
+			status = 'open'
+		to_do = {'id': self.new_id(), 'name': name, 'notes': notes, 'status': status, 'tags': tags}
+		self.project(project_name)['to_dos'].insert(0, to_do)
+		return to_do['id']
+
+	def update_to_do(self, name, project_name):
+		return self.update(self.to_do(project_name, name))
+
+	def update_to_do_by_id(self, things_id):
+		return self.update(self.to_do_with_id(things_id))
+
+	def update(self, to_do):
+		properties = {'name': 'name', 'notes': 'notes', 'tag names': 'tags'}
+		for match in re.finditer(r'set (name|notes|tag names) of updateToDo to %s' % STRING, self.fragment):
+			to_do[properties[match.group(1)]] = unquote(match.group(2))
+		return ''
+
+	def complete_to_do(self, name, project_name):
+		self.to_do(project_name, name)['status'] = 'completed'
+		return ''
+
+	def complete_to_do_by_id(self, things_id):
+		self.to_do_with_id(things_id)['status'] = 'completed'
+		return ''
+
+	def set_to_do_tags(self, name, project_name, tags):
+		self.to_do(project_name, name)['tags'] = tags
+		return ''
+
+	def set_to_do_tags_by_id(self, things_id, tags):
+		self.to_do_with_id(things_id)['tags'] = tags
+		return ''
+
+	def log_completed(self):
+		self.state['logged'] += 1
+		return ''
+
+	def run_fragment(self, fragment):
+		fragment = fragment.strip()
+		self.fragment = fragment
+		for (pattern, command) in self.commands:
+			match = re.match(pattern, fragment, re.DOTALL)
+			if match:
+				self.calls[command.__name__] = self.calls.get(command.__name__, 0) + 1
+				return command(*[unquote(group) for group in match.groups()])
+		raise FakeError(-2741, 'Fake Things can\'t run: %s' % fragment)
+
+	def run(self, script):
+		"""Run a script generated by things.build_script. Returns (stdout, stderr)."""
+
+		blocks = re.split(r'\n\t-- keeper operation \d+\n', script)
+		if len(blocks) < 2:
+			return ('', 'syntax error: Fake Things only understands keeper batches. (-2741)\n')
+
+		results = []
+		for index, block in enumerate(blocks[1:]):
+			match = re.match(r'\ttry\n\t\tset opResult to ""\n(.*?)\n\t\tset keeperResults to ', block, re.DOTALL)
+			if match is None:
+				return ('', 'syntax error: Malformed keeper operation %d. (-2741)\n' % index)
+			try:
+				value = self.run_fragment(match.group(1))
+				status = 'ok'
+			except FakeError as error:
+				value = '%s (%d)' % (error.message, error.number)
+				status = 'error'
+			results.append(things.FIELD_SEPARATOR.join([str(index), status, value]))
+
+		stdout = ''.join([result + things.RESULT_SEPARATOR for result in results])
+		return (stdout + '\n', '')
+
+class FakeTransport(object):
+	"""A things.py transport that runs scripts against a FakeThings instead of osascript.
+
+	Each script takes script_latency seconds plus operation_latency seconds for every
+	operation in it, standing in for the time osascript and Things take."""
+
+	def __init__(self, fake=None, script_latency=0.0, operation_latency=0.0):
+		if fake is None:
+			fake = FakeThings()
+		self.fake = fake
+		self.script_latency = script_latency
+		self.operation_latency = operation_latency
+		self.scripts = 0
+		self.operations = 0
+
+	def run(self, cmd):
+		operations = len(re.findall(r'\n\t-- keeper operation \d+\n', cmd))
+		self.scripts += 1
+		self.operations += operations
+
+		latency = self.script_latency + self.operation_latency * operations
+		if latency > 0:
+			time.sleep(latency)
+		return self.fake.run(cmd)
+
+	def close(self):
+		pass
+
+def load(path):
+	if path is not None and os.path.isfile(path):
+		f = open(path, 'r')
+		state = json.load(f)
+		f.close()
+		return FakeThings(state)
+	return FakeThings()
+
+def save(fake, path):
+	if path is None:
+		return
+	f = open(path, 'w')
+	json.dump(fake.state, f, indent=1)
+	f.close()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+#
+#  lighthouse_server.py
+#  A local stand-in for the Lighthouse API that serves synthetic projects and tickets.
+#
+#  Usage:
+#    > python tools/lighthouse_server.py --port 8000 --projects 5 --tickets 200 --delay 0.1
+#    > python keeper.py --base-url http://localhost:8000/ -a test -t test ...
+#
+#  Serves projects.xml and projects/<id>/tickets.xml?page=N, 30 tickets per page
+#  like Lighthouse, after sleeping for --delay seconds. Every response is generated
+#  from the options alone, so runs are reproducible. Connections are kept alive
+#  (HTTP/1.1) unless --no-keep-alive is given. Responses carry an ETag, and
+#  requests that send it back in If-None-Match get a 304. Bodies are gzipped for
+#  clients that accept it.
+#
+#  Copyright 2010 Jeff Verkoeyen. Licensed under the Apache License, Version 2.0.
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+
+from optparse import OptionParser
+import BaseHTTPServer
+import SocketServer
+import StringIO
+import cgi
+import gzip
+import hashlib
+import re
+import threading
+import time
+import urlparse
+
+TICKETS_PER_PAGE = 30
+
+class Options(object):
+	"""The shape of the synthetic account."""
+
+	def __init__(self, projects=3, tickets=100, body_size=200, tags=3, versions=3, delay=0.0):
+		self.projects = projects
+		self.tickets = tickets
+		self.body_size = body_size
+		self.tags = tags
+		self.versions = versions
+		self.delay = delay
+
+def body(number, size):
+	text = 'Ticket %d says &quot;fix &amp; ship&quot; when 1 &lt; 2. ' % (number)
+	return text * max(1, size / len(text))
+
+def projects_xml(options):
+	projects = []
+	for project_id in range(1, options.projects + 1):
+		projects.append("""  <project>
+    <archived type="boolean">false</archived>
+    <created-at type="datetime">2010-09-01T10:00:00Z</created-at>
+    <description>Synthetic project %d</description>
+    <id type="integer">%d</id>
+    <name>Project %d</name>
+    <open-tickets-count type="integer">%d</open-tickets-count>
+    <permalink>project-%d</permalink>
+    <public type="boolean">false</public>
+    <updated-at type="datetime">2010-09-30T10:00:00Z</updated-at>
+  </project>
+""" % (project_id, project_id, project_id, options.tickets, project_id))
+	return '<?xml version="1.0" encoding="UTF-8"?>\n<projects type="array">\n%s</projects>\n' % (''.join(projects))
+
+def ticket_xml(options, project_id, number):
+	tags = ' '.join(['tag%d' % (i) for i in range(options.tags)])
+	if options.tags > 1:
+		tags = '&quot;multi word&quot; ' + tags
+	state = 'open'
+	if number % 3 == 0:
+		state = 'resolved'
+	text = body(number, options.body_size)
+	versions = []
+	for version in range(1, options.versions + 1):
+		versions.append("""      <version type="Ticket::Version">
+        <body>%s</body>
+        <created-at type="datetime">2010-09-%02dT10:00:00Z</created-at>
+        <number type="integer">%d</number>
+        <state>open</state>
+        <title>Ticket %d</title>
+        <updated-at type="datetime">2010-09-%02dT10:00:00Z</updated-at>
+        <version type="integer">%d</version>
+      </version>
+""" % (text, version % 28 + 1, number, number, version % 28 + 1, version))
+	return """  <ticket>
+    <assigned-user-id type="integer">1</assigned-user-id>
+    <closed type="boolean">%s</closed>
+    <created-at type="datetime">2010-09-01T10:00:00Z</created-at>
+    <milestone-id type="integer" nil="true"></milestone-id>
+    <number type="integer">%d</number>
+    <permalink>ticket-%d</permalink>
+    <priority type="integer">%d</priority>
+    <project-id type="integer">%d</project-id>
+    <state>%s</state>
+    <tag>%s</tag>
+    <title>Ticket %d</title>
+    <updated-at type="datetime">2010-09-%02dT10:00:00Z</updated-at>
+    <url>http://test.lighthouseapp.com/projects/%d/tickets/%d</url>
+    <original-body>%s</original-body>
+    <latest-body>%s</latest-body>
+    <versions type="array">
+%s    </versions>
+  </ticket>
+""" % (str(state == 'resolved').lower(), number, number, number, project_id, state, tags,
+	number, number % 28 + 1, project_id, number, text, text, ''.join(versions))
+
+def tickets_xml(options, project_id, page):
+	tickets = []
+	if 1 <= project_id <= options.projects:
+		first = (page - 1) * TICKETS_PER_PAGE + 1
+		last = min(options.tickets, page * TICKETS_PER_PAGE)
+		for number in range(first, last + 1):
+			tickets.append(ticket_xml(options, project_id, number))
+	if len(tickets) == 0:
+		# Like Lighthouse (and Rails), an empty page is an untyped array.
+		return '<?xml version="1.0" encoding="UTF-8"?>\n<nil-classes type="array"/>\n'
+	return '<?xml version="1.0" encoding="UTF-8"?>\n<tickets type="array">\n%s</tickets>\n' % (''.join(tickets))
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+	# Send each response in one piece, as a real server would, instead of a write per header.
+	wbufsize = -1
+	disable_nagle_algorithm = True
+
+	def setup(self):
+		if self.server.keep_alive:
+			self.protocol_version = 'HTTP/1.1'
+		BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+	def do_GET(self):
+		options = self.server.options
+		url = urlparse.urlparse(self.path)
+		query = cgi.parse_qs(url.query)
+
+		self.server.count_request()
+		time.sleep(options.delay)
+
+		match = re.match(r'^/projects/(\d+)/tickets\.xml$', url.path)
+		if url.path == '/projects.xml':
+			xml = projects_xml(options)
+		elif match:
+			page = int(query.get('page', ['1'])[0])
+			xml = tickets_xml(options, int(match.group(1)), page)
+		else:
+			self.send_error(404)
+			return
+
+		etag = '"%s"' % (hashlib.md5(xml).hexdigest())
+		if self.headers.getheader('If-None-Match') == etag:
+			self.server.count_not_modified()
+			self.send_response(304)
+			self.send_header('ETag', etag)
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			return
+
+		body = xml
+		is_gzipped = 'gzip' in (self.headers.getheader('Accept-Encoding') or '')
+		if is_gzipped:
+			buffer = StringIO.StringIO()
+			compressed = gzip.GzipFile(fileobj=buffer, mode='wb')
+			compressed.write(xml)
+			compressed.close()
+			body = buffer.getvalue()
+		self.server.count_bytes(len(body))
+
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/xml; charset=utf-8')
+		self.send_header('Content-Length', str(len(body)))
+		if is_gzipped:
+			self.send_header('Content-Encoding', 'gzip')
+		self.send_header('ETag', etag)
+		self.send_header('Last-Modified', 'Thu, 30 Sep 2010 10:00:00 GMT')
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self, address, options, keep_alive=True):
+		BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+		self.options = options
+		self.keep_alive = keep_alive
+		self.requests = 0
+		self.not_modified = 0
+		self.bytes_sent = 0
+		self.connections = 0
+		self.lock = threading.Lock()
+
+	def process_request(self, request, client_address):
+		self.lock.acquire()
+		self.connections += 1
+		self.lock.release()
+		SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+
+	def count_request(self):
+		self.lock.acquire()
+		self.requests += 1
+		self.lock.release()
+
+	def count_bytes(self, count):
+		self.lock.acquire()
+		self.bytes_sent += count
+		self.lock.release()
+
+	def count_not_modified(self):
+		self.lock.acquire()
+		self.not_modified += 1
+		self.lock.release()
+
+	def url(self):
+		return 'http://127.0.0.1:%d/' % (self.server_address[1])
+
+def start(options, port=0, keep_alive=True):
+	"""Serve on a background thread. Returns the server; its url() is the base URL."""
+
+	server = Server(('127.0.0.1', port), options, keep_alive)
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	return server
+
+if __name__ == "__main__":
+	parser = OptionParser()
+	parser.add_option("--port", dest="port", type="int", default=8000)
+	parser.add_option("--projects", dest="projects", type="int", default=3)
+	parser.add_option("--tickets", dest="tickets", type="int", default=100, help="Tickets per project")
+	parser.add_option("--body-size", dest="body_size", type="int", default=200, help="Bytes per ticket body")
+	parser.add_option("--tags", dest="tags", type="int", default=3, help="Tags per ticket")
+	parser.add_option("--versions", dest="versions", type="int", default=3, help="Versions per ticket")
+	parser.add_option("--delay", dest="delay", type="float", default=0.0, help="Seconds to wait before each response")
+	parser.add_option("--no-keep-alive", dest="keep_alive", action="store_false", default=True,
+						help="Close the connection after every response")
+	(args, rest) = parser.parse_args()
+
+	options = Options(args.projects, args.tickets, args.body_size, args.tags, args.versions, args.delay)
+	server = Server(('127.0.0.1', args.port), options, args.keep_alive)
+	print "Serving %d projects of %d tickets on %s" % (options.projects, options.tickets, server.url())
+	server.serve_forever()